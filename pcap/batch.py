@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import json
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from argparse import ArgumentParser
+from bin_parser.pcap import pcap
+
+# names of the captures picked up in directories, plain or compressed;
+# this leaves out the .idx sidecars of pcap.RecordIndex
+SUFFIXES = tuple(ext + comp for ext in ('.pcap', '.pcapng') for comp in ('', '.gz', '.xz', '.zst'))
+
+def expand(inputs):
+    '''
+    files named by the inputs, which may be files, directories or glob patterns.
+    directories are searched recursively for names ending in one of SUFFIXES.
+    '''
+    paths = []
+    for name in inputs:
+        if os.path.isdir(name):
+            found = glob.glob(os.path.join(name, '**', '*.pcap*'), recursive=True)
+            paths.extend(sorted(path for path in found if path.endswith(SUFFIXES) and os.path.isfile(path)))
+        elif glob.has_magic(name):
+            paths.extend(sorted(glob.glob(name, recursive=True)))
+        else:
+            paths.append(name)
+    return paths
+
+def summarize(path):
+    '''
+    read one capture in a single streaming pass and return a small summary dict:
+    link type, record and per event type counts, time span and any error.
+    whatever goes wrong with the file ends up in the error field, so that one
+    bad capture does not stop a batch.
+    '''
+    summary = {'path': path, 'link_type': None, 'records': 0, 'events': {},
+               'malformed': 0, 'start': None, 'end': None, 'error': None}
+    try:
+        with open(path, 'rb') as f:
+            cap = pcap.Capture(f)
+            summary['link_type'] = cap.header.link_type
+            first = last = None
+            module = pcap.decoder(cap.header.link_type)
+            if module is not None:
+                r = module.Reader(f, capture=cap)
+                events = Counter()
+                for ev in r:
+                    events[ev.ev_type] += 1
+                    last = ev.pcap_sec + ev.pcap_usec / 1000000
+                    if first is None:
+                        first = last
+                summary['records'] = sum(events.values())
+                summary['events'] = dict(events)
+                summary['malformed'] = r.malformed
+            else:
+                def on_error(err):
+                    summary['malformed'] += 1
+
+                div = 1000000000 if cap.nsec else 1000000
+                for ph, _ in cap.records(on_error):
+                    summary['records'] += 1
+                    last = ph.timestamp_sec + ph.timestamp_usec / div
+                    if first is None:
+                        first = last
+            summary['start'] = first
+            summary['end'] = last
+    except Exception as err:
+        summary['error'] = f'{type(err).__name__}: {err}'
+    return summary
+
+class Report:
+    '''summaries of many captures merged into totals'''
+
+    def __init__(self):
+        self.files = []
+        self.records = 0
+        self.events = Counter()
+        self.link_types = Counter()
+        self.malformed = 0
+        self.errors = []
+        self.start = None
+        self.end = None
+
+    def add(self, summary):
+        self.files.append(summary)
+        if summary['error'] is not None:
+            self.errors.append((summary['path'], summary['error']))
+        if summary['link_type'] is not None:
+            self.link_types[summary['link_type']] += 1
+        self.records += summary['records']
+        self.events.update(summary['events'])
+        self.malformed += summary['malformed']
+        if summary['start'] is not None:
+            self.start = summary['start'] if self.start is None else min(self.start, summary['start'])
+            self.end = summary['end'] if self.end is None else max(self.end, summary['end'])
+
+    def as_dict(self):
+        return {'files': self.files, 'records': self.records, 'events': dict(self.events),
+                'link_types': dict(self.link_types), 'malformed': self.malformed,
+                'errors': self.errors, 'start': self.start, 'end': self.end}
+
+    def show(self):
+        for summary in self.files:
+            print(f"{summary['path']} : link type {summary['link_type']}, {summary['records']} records, "
+                  f"events {summary['events']}, {summary['start']} - {summary['end']}"
+                  + (f", error {summary['error']}" if summary['error'] else ''))
+        print('----------------------------')
+        print(f'files : {len(self.files)}')
+        print(f'records : {self.records}')
+        print(f'events per type : {dict(self.events)}')
+        print(f'link-layer header types : {dict(self.link_types)}')
+        print(f'malformed records : {self.malformed}')
+        print(f'time span : {self.start} - {self.end}')
+        print(f'errors : {len(self.errors)}')
+        for path, error in self.errors:
+            print(f'  {path} : {error}')
+
+def run(paths, workers=None):
+    '''
+    summarize the captures in a pool of worker processes and merge the results
+    into a Report. only a few files per worker are in flight at any time, so
+    memory stays bounded however many files are given.
+    '''
+    workers = workers or os.cpu_count()
+    report = Report()
+    pending = set()
+    paths = iter(paths)
+    with ProcessPoolExecutor(workers) as pool:
+        for path in paths:
+            pending.add(pool.submit(summarize, path))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    report.add(future.result())
+        for future in pending:
+            report.add(future.result())
+    report.files.sort(key=lambda summary: summary['path'])
+    return report
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='summarize many capture files at once')
+    parser.add_argument('inputs', nargs='+', help='capture files, directories or glob patterns')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    report = run(expand(args.inputs), args.workers)
+    if args.json:
+        print(json.dumps(report.as_dict()))
+    else:
+        report.show()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+benchmark the read paths on a synthetic or given evdev capture
+
+    python -m bin_parser.pcap.bench -n 2000000 --json now.json --compare before.json
+
+every path runs in a fresh interpreter, so that its peak RSS is its own,
+and the best of --repeat runs is kept. rates are over all the records of
+the capture, whatever the path returns.
+'''
+
+import os
+import sys
+import json
+import time
+import tempfile
+import resource
+import subprocess
+
+from argparse import ArgumentParser, SUPPRESS
+
+def _iter_events(path):
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+    with open(path, 'rb') as f:
+        return sum(1 for _ in evdev.Reader(f))
+
+def _query(path):
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+    with open(path, 'rb') as f:
+        return sum(1 for _ in evdev.Reader(f).query('EV_KEY value=1'))
+
+def _iter_frames(path):
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+    with open(path, 'rb') as f:
+        return sum(1 for _ in evdev.Reader(f).iter_frames())
+
+def _to_events(path):
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+    with open(path, 'rb') as f:
+        return len(evdev.Reader(f).to_events())
+
+def _iter_records(path):
+    from bin_parser.pcap import pcap
+
+    with open(path, 'rb') as f:
+        buf = pcap.map_file(f)
+    header = pcap.header_class(buf).from_buffer_copy(buf)
+    return sum(1 for _ in pcap.iter_records(buf, packet_header=header.packet_header))
+
+def _read_array(path):
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+    with open(path, 'rb') as f:
+        return len(evdev.read_array(f))
+
+def _iter_arrays(path):
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+    with open(path, 'rb') as f:
+        return sum(map(len, evdev.iter_arrays(f)))
+
+def _read_array_parallel(path):
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+    return len(evdev.read_array_parallel(path))
+
+def _stats(path):
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+    from bin_parser.pcap.linktypes.evdev_stats import Stats
+
+    with open(path, 'rb') as f:
+        return sum(Stats.from_array(evdev.read_array(f)).events.values())
+
+def _aiter_events(path):
+    import asyncio
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+    async def count():
+        stream = asyncio.StreamReader()
+        with open(path, 'rb') as f:
+            stream.feed_data(f.read())
+        stream.feed_eof()
+        return sum([1 async for _ in evdev.aiter_events(stream)])
+    return asyncio.run(count())
+
+# read path -> function decoding the capture at a path and returning a count
+PATHS = {'iter_records': _iter_records,
+         'iter_events': _iter_events,
+         'query': _query,
+         'iter_frames': _iter_frames,
+         'to_events': _to_events,
+         'aiter_events': _aiter_events,
+         'read_array': _read_array,
+         'iter_arrays': _iter_arrays,
+         'read_array_parallel': _read_array_parallel,
+         'stats': _stats}
+
+def run_one(name, path):
+    '''time one path in this process: seconds, the count it returned and peak RSS in bytes'''
+    start = time.perf_counter()
+    result = PATHS[name](path)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    return {'seconds': seconds, 'result': result,
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+def run(names, path, repeat=3):
+    '''
+    benchmark the named paths on the capture at path, each in a child interpreter.
+    returns {name: {'seconds', 'result', 'max_rss', 'events_per_s', 'mb_per_s'}}
+    '''
+    from bin_parser.pcap import pcap
+
+    with open(path, 'rb') as f:
+        records = sum(1 for _ in pcap.Capture(f).records())
+    size = os.path.getsize(path)
+    results = {}
+    for name in names:
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, '-m', 'bin_parser.pcap.bench', '--run', name, path],
+                                 check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(out))
+        best = min(runs, key=lambda r: r['seconds'])
+        best['max_rss'] = max(r['max_rss'] for r in runs)
+        best['events_per_s'] = records / best['seconds']
+        best['mb_per_s'] = size / best['seconds'] / 1e6
+        results[name] = best
+    return results
+
+def show(results, baseline=None):
+    print(f'{"path":<20} {"events/s":>12} {"MB/s":>9} {"peak RSS MB":>12}' + ('  vs baseline' if baseline else ''))
+    for name, r in results.items():
+        line = f'{name:<20} {r["events_per_s"]:>12,.0f} {r["mb_per_s"]:>9.1f} {r["max_rss"] / 1e6:>12.1f}'
+        if baseline and name in baseline:
+            line += f'  {r["events_per_s"] / baseline[name]["events_per_s"]:.2f}x'
+        print(line)
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='benchmark the capture read paths')
+    parser.add_argument('capture', nargs='?', default=None, help='evdev capture, a synthetic one by default')
+    parser.add_argument('-n', '--events', type=int, default=1000000, help='events of the synthetic capture')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-p', '--paths', nargs='+', choices=list(PATHS), default=list(PATHS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', default=None, help='save the results to this file')
+    parser.add_argument('--compare', default=None, help='results saved by an earlier --json run')
+    parser.add_argument('--run', default=None, help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # child side of run(): time one path and report on stdout
+        print(json.dumps(run_one(args.run, args.capture)))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.capture
+        if path is None:
+            from bin_parser.pcap.linktypes import evdev_synth
+
+            path = os.path.join(tmp, 'synth.pcap')
+            with open(path, 'wb') as f:
+                evdev_synth.generate(f, args.events, args.seed)
+        results = run(args.paths, path, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    show(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+bin-parser command line
+
+    python -m bin_parser.pcap.cli headers|events|keys|stats [options] FILE...
+
+FILE may be - for the standard input. decoders and numpy are only imported
+by the subcommands that need them, to keep startup fast in shell pipelines.
+'''
+
+import io
+import os
+import sys
+
+from itertools import islice
+from argparse import ArgumentParser
+from bin_parser.pcap import pcap
+
+class Output:
+    '''
+    rows written as tab separated text, JSON lines or CSV, gathered in a
+    block buffer and handed to the stream `block` bytes at a time
+    '''
+
+    def __init__(self, fields, fmt='text', stream=None, block=1 << 16):
+        self.fields = fields
+        self.fmt = fmt
+        self.stream = sys.stdout if stream is None else stream
+        self.block = block
+        self.buf = io.StringIO()
+        if fmt == 'jsonl':
+            import json
+
+            self.__dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+        elif fmt == 'csv':
+            import csv
+
+            self.__csv = csv.writer(self.buf)
+            self.__csv.writerow(fields)
+        elif fmt == 'text':
+            self.buf.write('\t'.join(fields) + '\n')
+        else:
+            raise ValueError(f'unknown output format {fmt}')
+
+    def row(self, values):
+        if self.fmt == 'jsonl':
+            self.buf.write(self.__dumps(dict(zip(self.fields, values))) + '\n')
+        elif self.fmt == 'csv':
+            self.__csv.writerow(values)
+        else:
+            self.buf.write('\t'.join(map(str, values)) + '\n')
+        if self.buf.tell() >= self.block:
+            self.flush()
+
+    def flush(self):
+        self.stream.write(self.buf.getvalue())
+        self.buf.seek(0)
+        self.buf.truncate()
+
+def open_input(name):
+    return sys.stdin.buffer if name == '-' else open(name, 'rb')
+
+def _in_range(ts, args):
+    '''ts in microseconds against --start and --end, in seconds'''
+    return ((args.start is None or ts >= args.start * 1000000)
+            and (args.end is None or ts < args.end * 1000000))
+
+def cmd_headers(args):
+    '''global headers, or with --records the record headers, of each capture'''
+    if args.records:
+        out = Output(['file', 'pcap_sec', 'pcap_usec', 'cap_len', 'pkt_len'], args.format)
+    else:
+        out = Output(['file', 'format', 'byteorder', 'nsec', 'version', 'snap_len', 'link_type'], args.format)
+    for name in args.files:
+        with open_input(name) as f:
+            cap = pcap.Capture(f)
+            h = cap.header
+            if not args.records:
+                out.row([name, 'pcapng' if cap.pcapng else 'pcap', cap.byteorder, cap.nsec,
+                         f'{h.major_ver}.{h.minor_ver}', h.snap_len, h.link_type])
+                continue
+            div = 1000 if cap.nsec else 1
+            rows = ([name, ph.timestamp_sec, ph.timestamp_usec // div, ph.cap_len, ph.pkt_len]
+                    for ph, _ in cap.records())
+            rows = (row for row in rows if _in_range(row[1] * 1000000 + row[2], args))
+            for row in islice(rows, args.count):
+                out.row(row)
+    out.flush()
+
+def _reader(f, args):
+    if args.instruments is None:
+        return pcap.open_reader(f)
+    return pcap.open_reader(f, instruments=args.instruments)
+
+def _query(args, text):
+    from bin_parser.pcap.linktypes.evdev_query import Query
+
+    q = Query.parse(text)
+    # --start and --end take over from the times of the query text only when given
+    if args.start is not None:
+        q.start = args.start
+    if args.end is not None:
+        q.end = args.end
+    return q
+
+def _head(chunks, count):
+    '''text chunks cut after count characters in all, or all of them when count is None'''
+    for chunk in chunks:
+        if count is not None:
+            if count <= 0:
+                return
+            chunk = chunk[:count]
+            count -= len(chunk)
+        yield chunk
+
+def cmd_events(args):
+    '''decoded evdev events'''
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+    out = Output(['file', 'pcap_sec', 'pcap_usec', 'timestamp_sec', 'timestamp_usec',
+                  'ev_type', 'ev_code', 'ev_value', 'type', 'code'], args.format)
+    q = _query(args, args.query or '')
+    for name in args.files:
+        with open_input(name) as f:
+            for ev in islice(_reader(f, args).query(q), args.count):
+                out.row([name, *ev, evdev.type_name(ev.ev_type), evdev.code_name(ev.ev_type, ev.ev_code)])
+    out.flush()
+
+def cmd_keys(args):
+    '''key presses, every key event with --all, or the typed text with --text'''
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+    if args.text:
+        from bin_parser.pcap.linktypes.evdev_keymap import TextDecoder
+
+        # plain text is written as typed, the other formats get one row per file
+        out = None if args.format == 'text' else Output(['file', 'text'], args.format)
+        for name in args.files:
+            with open_input(name) as f:
+                events = _reader(f, args).query(_query(args, 'EV_KEY'))
+                text = _head(TextDecoder(args.keymap).decode(events), args.count)
+                if out is None:
+                    for chunk in text:
+                        sys.stdout.write(chunk)
+                else:
+                    out.row([name, ''.join(text)])
+        if out is not None:
+            out.flush()
+        return
+
+    out = Output(['file', 'pcap_sec', 'pcap_usec', 'ev_code', 'ev_value', 'code', 'glyph'], args.format)
+    q = _query(args, 'EV_KEY' if args.all else 'EV_KEY value=1')
+    for name in args.files:
+        with open_input(name) as f:
+            for ev in islice(_reader(f, args).query(q), args.count):
+                out.row([name, ev.pcap_sec, ev.pcap_usec, ev.ev_code, ev.ev_value,
+                         evdev.code_name(1, ev.ev_code), evdev.code_glyph(1, ev.ev_code)])
+    out.flush()
+
+def cmd_stats(args):
+    '''activity statistics of each capture and, for several, their total'''
+    from bin_parser.pcap.linktypes import linux_evdev as evdev
+    from bin_parser.pcap.linktypes.evdev_stats import Stats
+
+    timed = args.start is not None or args.end is not None
+    total = []
+    for name in args.files:
+        with open_input(name) as f:
+            if name == '-' or timed or args.instruments is not None:
+                stats = Stats(args.gap).update(_reader(f, args).query(_query(args, '')))
+            else:
+                # read_array takes any capture for evdev, so look at the link type first
+                link_type = pcap.Capture(f).header.link_type
+                if pcap.decoder(link_type) is not evdev:
+                    raise ValueError(f'no evdev decoder for link type {link_type}')
+                f.seek(0)
+                stats = Stats.from_array(evdev.read_array(f), args.gap)
+        total.append(stats)
+        _show_stats(name, stats, args.format)
+    if len(total) > 1:
+        _show_stats('total', sum(total), args.format)
+
+def _show_stats(name, stats, fmt):
+    if fmt == 'text':
+        print(f'{name} :')
+        stats.show()
+        return
+    import json
+
+    # csv has no room for nested statistics, so both write JSON lines
+    print(json.dumps({'file': name, **stats.as_dict()}, default=str))
+
+COMMANDS = {'headers': cmd_headers, 'events': cmd_events, 'keys': cmd_keys, 'stats': cmd_stats}
+
+def parser():
+    parser = ArgumentParser(prog='bin-parser', description='read pcap and evdev captures')
+    commands = parser.add_subparsers(dest='command', required=True)
+    common = ArgumentParser(add_help=False)
+    common.add_argument('files', nargs='+', metavar='FILE', help='capture files, - for the standard input')
+    common.add_argument('-f', '--format', choices=('text', 'jsonl', 'csv'), default='text')
+    common.add_argument('-n', '--count', type=int, default=None, help='rows per file at most, characters with keys --text')
+    common.add_argument('--start', type=float, default=None, help='first pcap time, in seconds')
+    common.add_argument('--end', type=float, default=None, help='end pcap time, in seconds, excluded')
+    common.add_argument('--instrument', action='store_true', help='report counters and stage timings on stderr')
+    common.add_argument('--progress', type=float, default=None, metavar='SECONDS',
+                        help='report progress on stderr every SECONDS')
+    common.add_argument('--profile', action='store_true', help='profile with cProfile, report on stderr')
+    common.add_argument('--profile-memory', action='store_true', help='trace allocations too')
+
+    cmd = commands.add_parser('headers', parents=[common], help=cmd_headers.__doc__)
+    cmd.add_argument('--records', action='store_true', help='the record headers instead')
+    cmd = commands.add_parser('events', parents=[common], help=cmd_events.__doc__)
+    cmd.add_argument('-q', '--query', default=None, help="e.g. 'BTN_LEFT value=1'")
+    cmd = commands.add_parser('keys', parents=[common], help=cmd_keys.__doc__)
+    cmd.add_argument('--all', action='store_true', help='releases and auto-repeats too')
+    cmd.add_argument('--text', action='store_true', help='the typed text')
+    cmd.add_argument('--keymap', default='us', choices=('us', 'jis', 'de'))
+    cmd = commands.add_parser('stats', parents=[common], help=cmd_stats.__doc__)
+    cmd.add_argument('--gap', type=float, default=60, help='shortest gap reported, in seconds')
+    return parser
+
+def main(argv=None):
+    cli = parser()
+    args = cli.parse_args(argv)
+    if args.command == 'headers' and (args.instrument or args.progress):
+        cli.error('--instrument and --progress measure decoded events, headers decodes none')
+    args.instruments = None
+    if args.instrument or args.progress:
+        from bin_parser.pcap.instrument import Instruments
+
+        def progress(inst):
+            print(inst.summary(), file=sys.stderr)
+        args.instruments = Instruments(progress if args.progress else None, args.progress or 1.0)
+    try:
+        if args.profile or args.profile_memory:
+            from bin_parser.pcap.instrument import profiling
+
+            with profiling(args.profile, args.profile_memory):
+                COMMANDS[args.command](args)
+        else:
+            COMMANDS[args.command](args)
+        sys.stdout.flush()
+        if args.instrument:
+            print(args.instruments.report(), file=sys.stderr)
+    except BrokenPipeError:
+        # the reader went away, e.g. head; keep the interpreter from complaining at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except (OSError, ValueError) as err:
+        print(f'bin-parser: {err}', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
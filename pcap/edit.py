@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import heapq
+import struct
+
+from argparse import ArgumentParser
+from bin_parser.pcap import pcap
+
+def open_capture(path):
+    '''map a classic pcap file and read its global header'''
+    with open(path, 'rb') as f:
+        buf = pcap.map_file(f)
+    if bytes(buf[:4]) == pcap.PCAPNG_MAGIC:
+        raise ValueError(f'{path}: editing needs a classic pcap file')
+    return buf, pcap.header_class(buf).from_buffer_copy(buf)
+
+def _check_output(dst, srcs):
+    '''
+    refuse to write over an input: opening dst truncates it under the mapping
+    of the source, and the next read of that mapping kills the process
+    '''
+    if not os.path.exists(dst):
+        return
+    for src in srcs:
+        if os.path.samefile(src, dst):
+            raise ValueError(f'{dst}: output is the input {src}')
+
+def _walk(buf, header):
+    '''
+    (offset, end, timestamp) of every whole record of a mapped capture, the
+    timestamp in microseconds. plain struct unpacking keeps this loop cheap.
+    '''
+    unpack = struct.Struct(header.byteorder + 'III').unpack_from
+    hdr_len = header.packet_header.__hdr_len__
+    div = 1000 if header.nsec else 1
+    size = len(buf)
+    offset = pcap.PcapHeader.__hdr_len__
+    while offset + hdr_len <= size:
+        sec, frac, cap_len = unpack(buf, offset)
+        end = offset + hdr_len + cap_len
+        if end > size:
+            break
+        yield offset, end, sec * 1000000 + frac // div
+        offset = end
+
+def filter_capture(src, dst, keep):
+    '''
+    copy the records of src for which keep(timestamp, payload) is true to dst,
+    the timestamp being in microseconds and the payload a memoryview.
+    runs of consecutive kept records are written as single byte ranges of the
+    mapped source. returns the number of records written.
+    '''
+    _check_output(dst, [src])
+    buf, header = open_capture(src)
+    view = memoryview(buf)
+    hdr_len = header.packet_header.__hdr_len__
+    with open(dst, 'wb') as f, pcap.Writer(f, header=header) as w:
+        run_start = run_end = None
+        count = 0
+        for offset, end, ts in _walk(buf, header):
+            if not keep(ts, view[offset + hdr_len:end]):
+                continue
+            if offset != run_end:
+                if run_start is not None:
+                    w.write_raw(view[run_start:run_end], count)
+                run_start, count = offset, 0
+            run_end = end
+            count += 1
+        if run_start is not None:
+            w.write_raw(view[run_start:run_end], count)
+    return w.records
+
+def query_filter(q, header):
+    '''
+    a keep function for filter_capture from an evdev_query.Query or its text form,
+    for evdev captures with the given global header
+    '''
+    from bin_parser.pcap.linktypes.evdev_query import Query, VALUE_AT
+
+    if isinstance(q, str):
+        q = Query.parse(q)
+    match = q.compile(header.byteorder)
+    start, end = q.span()
+
+    def keep(ts, payload):
+        if len(payload) < VALUE_AT + 4:
+            return False
+        if start is not None and ts < start or end is not None and ts >= end:
+            return False
+        return match is None or match(bytes(payload))
+    return keep
+
+def split_capture(src, pattern, records=None, seconds=None):
+    '''
+    split src into files named pattern.format(n) of at most `records` records
+    or `seconds` seconds each, every part being one byte range of the source.
+    returns the paths written.
+    '''
+    if not records and not seconds:
+        raise ValueError('split by records or by seconds')
+    buf, header = open_capture(src)
+    view = memoryview(buf)
+    span = int(seconds * 1000000) if seconds else None
+
+    parts = []
+    first = start = run_end = None
+    count = 0
+    for offset, end, ts in _walk(buf, header):
+        if start is not None and (records and count >= records or span and ts - first >= span):
+            parts.append((start, run_end, count))
+            start = None
+        if start is None:
+            first, start, count = ts, offset, 0
+        run_end = end
+        count += 1
+    if start is not None:
+        parts.append((start, run_end, count))
+
+    paths = []
+    for n, (start, end, count) in enumerate(parts):
+        path = pattern.format(n)
+        _check_output(path, [src])
+        with open(path, 'wb') as f, pcap.Writer(f, header=header) as w:
+            w.write_raw(view[start:end], count)
+        paths.append(path)
+    return paths
+
+def merge_captures(srcs, dst):
+    '''
+    merge classic pcap files of the same format and link type into dst in
+    timestamp order, each input being in time order itself; records with equal
+    timestamps keep the order of srcs. dst gets the largest snap_len of the inputs.
+    returns the number of records written.
+    '''
+    _check_output(dst, srcs)
+    captures = [open_capture(src) for src in srcs]
+    if not captures:
+        raise ValueError('nothing to merge')
+    header = captures[0][1]
+    for src, (_, other) in zip(srcs, captures):
+        if (other.byteorder, other.magic_num, other.link_type) != (header.byteorder, header.magic_num, header.link_type):
+            raise ValueError(f'{src}: format or link type differs from {srcs[0]}')
+    # records of any input must fit the snap_len of the output
+    header = type(header).from_buffer_copy(header)
+    header.snap_len = max(other.snap_len for _, other in captures)
+
+    def records(i, buf):
+        view = memoryview(buf)
+        for offset, end, ts in _walk(buf, header):
+            yield ts, i, view[offset:end]
+
+    with open(dst, 'wb') as f, pcap.Writer(f, header=header) as w:
+        for _, _, record in heapq.merge(*(records(i, buf) for i, (buf, _) in enumerate(captures))):
+            w.write_raw(record)
+    return w.records
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='filter, split or merge classic pcap files')
+    commands = parser.add_subparsers(dest='command', required=True)
+    cmd = commands.add_parser('filter', help='keep the evdev events matching a query')
+    cmd.add_argument('input')
+    cmd.add_argument('output')
+    cmd.add_argument('query', help="e.g. 'EV_KEY value=1 start=1600000000 end=1600000060'")
+    cmd = commands.add_parser('split', help='cut a capture into parts')
+    cmd.add_argument('input')
+    cmd.add_argument('pattern', help='output names, e.g. part-{:04d}.pcap')
+    cmd.add_argument('--records', type=int, default=None)
+    cmd.add_argument('--seconds', type=float, default=None)
+    cmd = commands.add_parser('merge', help='merge captures in timestamp order')
+    cmd.add_argument('output')
+    cmd.add_argument('inputs', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'filter':
+        _, header = open_capture(args.input)
+        print(f'{filter_capture(args.input, args.output, query_filter(args.query, header))} records written')
+    elif args.command == 'split':
+        for path in split_capture(args.input, args.pattern, args.records, args.seconds):
+            print(path)
+    else:
+        print(f'{merge_captures(args.inputs, args.output)} records written')
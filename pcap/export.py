@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+
+from argparse import ArgumentParser
+from bin_parser.pcap import pcap
+
+# columns of the captures whose payload is not decoded
+HEADER_DTYPE = [('pcap_sec', '<u4'),
+                ('pcap_usec', '<u4'),
+                ('cap_len', '<u4'),
+                ('pkt_len', '<u4')]
+
+# output file extension -> format
+EXTENSIONS = {'.parquet': 'parquet',
+              '.pq': 'parquet',
+              '.feather': 'feather',
+              '.arrow': 'feather',
+              '.csv': 'csv'}
+
+def iter_header_arrays(fileobj, chunk=1 << 16):
+    '''
+    the record headers of any capture as numpy arrays of HEADER_DTYPE of at
+    most chunk records, with pcap_usec in microseconds
+    '''
+    import numpy as np
+
+    cap = pcap.Capture(fileobj)
+    div = 1000 if cap.nsec else 1
+    rows = []
+    for ph, _ in cap.records():
+        rows.append((ph.timestamp_sec, ph.timestamp_usec // div, ph.cap_len, ph.pkt_len))
+        if len(rows) == chunk:
+            yield np.array(rows, np.dtype(HEADER_DTYPE))
+            rows = []
+    if rows:
+        yield np.array(rows, np.dtype(HEADER_DTYPE))
+
+def _columns(fileobj):
+    '''the decoder module whose iter_arrays decodes the capture, or None, and the dtype of its arrays'''
+    module = pcap.decoder(pcap.Capture(fileobj).header.link_type)
+    fileobj.seek(0)
+    if module is not None and hasattr(module, 'iter_arrays'):
+        return module, module.RECORD_DTYPE
+    return None, HEADER_DTYPE
+
+def iter_arrays(fileobj, chunk=1 << 16):
+    '''
+    the records of a capture as numpy structured arrays of at most chunk records.
+    link types whose decoder provides iter_arrays, such as evdev, are decoded
+    into header and payload columns, the others give the record headers only.
+    '''
+    module, _ = _columns(fileobj)
+    if module is not None:
+        return module.iter_arrays(fileobj, chunk)
+    return iter_header_arrays(fileobj, chunk)
+
+def to_batch(arr):
+    '''a pyarrow RecordBatch holding the fields of a numpy structured array as columns'''
+    import pyarrow as pa
+
+    names = arr.dtype.names
+    # arrow only takes native byte order
+    columns = [pa.array(arr[name].astype(arr.dtype[name].newbyteorder('='), copy=False)) for name in names]
+    return pa.RecordBatch.from_arrays(columns, names)
+
+def write(arrays, path, fmt=None, dtype=None):
+    '''
+    write numpy structured arrays to path one chunk at a time, as Parquet,
+    Feather (Arrow IPC) or CSV, guessing the format from the extension by default.
+    only one chunk is held in memory at a time. Parquet and Feather need pyarrow,
+    CSV is written with pyarrow when it is installed and with the csv module otherwise.
+    when there are no arrays, dtype, that of the arrays, gives the columns of
+    the empty file written. returns the number of rows written.
+    '''
+    if fmt is None:
+        fmt = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise ValueError(f'unknown output format for {path}')
+    if fmt not in ('parquet', 'feather', 'csv'):
+        raise ValueError(f'unknown output format {fmt}')
+
+    try:
+        import pyarrow
+    except ImportError:
+        if fmt != 'csv':
+            raise ImportError(f'writing {fmt} needs pyarrow') from None
+        return _write_csv(arrays, path, dtype)
+
+    rows = 0
+    writer = None
+    try:
+        for arr in arrays:
+            batch = to_batch(arr)
+            if writer is None:
+                writer = _open_writer(path, fmt, batch.schema)
+            if fmt == 'parquet':
+                writer.write_batch(batch)
+            else:
+                writer.write(batch)
+            rows += len(arr)
+        if writer is None:
+            # nothing to write: a file with the schema and no rows, which readers still accept
+            writer = _open_writer(path, fmt, to_batch(_empty(dtype)).schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+def _empty(dtype):
+    import numpy as np
+
+    if dtype is None:
+        raise ValueError('no arrays to write, and no dtype for the columns of an empty file')
+    return np.empty(0, np.dtype(dtype))
+
+def _open_writer(path, fmt, schema):
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(path, schema)
+    if fmt == 'feather':
+        import pyarrow as pa
+
+        return pa.ipc.new_file(path, schema)
+    import pyarrow.csv as pc
+
+    return pc.CSVWriter(path, schema)
+
+def _write_csv(arrays, path, dtype=None):
+    rows = 0
+    with open(path, 'w', newline='') as f:
+        out = csv.writer(f)
+        names = None
+        for arr in arrays:
+            if names is None:
+                names = arr.dtype.names
+                out.writerow(names)
+            out.writerows(arr.tolist())
+            rows += len(arr)
+        if names is None:
+            out.writerow(_empty(dtype).dtype.names)
+    return rows
+
+def export(fileobj, path, fmt=None, chunk=1 << 16):
+    '''
+    convert a capture to a columnar file in one streaming pass
+
+        export(open('kbd.pcap', 'rb'), 'kbd.parquet')
+    '''
+    module, dtype = _columns(fileobj)
+    arrays = iter_header_arrays(fileobj, chunk) if module is None else module.iter_arrays(fileobj, chunk)
+    return write(arrays, path, fmt, dtype)
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='export a capture to Parquet, Feather or CSV')
+    parser.add_argument('input', help='capture file')
+    parser.add_argument('output', help='output file, the format is taken from its extension')
+    parser.add_argument('-f', '--format', choices=('parquet', 'feather', 'csv'), default=None)
+    parser.add_argument('--chunk', type=int, default=1 << 16, help='records per chunk')
+    args = parser.parse_args()
+
+    with open(args.input, 'rb') as f:
+        rows = export(f, args.output, args.format, args.chunk)
+    print(f'{rows} records written to {args.output}')
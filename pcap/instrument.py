@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import sys
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+
+class TimedFile:
+    '''a file object proxy counting the bytes read and the time spent reading them'''
+
+    def __init__(self, fileobj, instruments):
+        self.__f = fileobj
+        self.__inst = instruments
+
+    def read(self, *args):
+        start = time.perf_counter()
+        data = self.__f.read(*args)
+        self.__inst.stages['io'] += time.perf_counter() - start
+        self.__inst.bytes_read += len(data)
+        return data
+
+    def readinto(self, buf):
+        start = time.perf_counter()
+        n = self.__f.readinto(buf)
+        self.__inst.stages['io'] += time.perf_counter() - start
+        self.__inst.bytes_read += n or 0
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self.__f, name)
+
+class Instruments:
+    '''
+    counters and stage timings of a read, for diagnosing throughput:
+    bytes read, records framed, malformed records and events per type, and
+    the seconds spent in each stage of the pipeline:
+
+        io        reading from the file; a mapped file is not read, its page
+                  faults count as framing and its records as bytes read
+        framing   splitting the stream into records, without io
+        decode    building events from the records, without framing and io
+        consumer  everything the caller does with the events, such as formatting
+
+    pass one to a reader, e.g. linux_evdev.Reader(f, instruments=inst); the
+    stages are measured by wrapping the file and the generators of the reader,
+    so nothing is counted or timed without it. progress, when given, is called
+    with the instruments about every `interval` seconds during the read.
+
+        inst = Instruments(progress=lambda i: print(i.summary(), file=sys.stderr))
+        for ev in Reader(f, instruments=inst):
+            ...
+        print(inst.report())
+    '''
+
+    # events between two looks at the clock for progress
+    __check_every__ = 4096
+
+    def __init__(self, progress=None, interval=1.0):
+        self.progress = progress
+        self.interval = interval
+        self.bytes_read = 0
+        self.records = 0
+        self.malformed = 0
+        self.events = Counter()
+        self.stages = Counter()
+        self.started = None
+        self.elapsed = 0.0
+
+    def wrap_file(self, fileobj):
+        return TimedFile(fileobj, self)
+
+    def timed(self, iterable, stage):
+        '''iterate, adding the time taken by each step, inner stages included, to stage'''
+        clock = time.perf_counter
+        stages = self.stages
+        it = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(it)
+            except StopIteration:
+                stages[stage] += clock() - start
+                return
+            stages[stage] += clock() - start
+            yield item
+
+    def records_of(self, records, mapped=False):
+        '''
+        time and count the (header, payload) pairs of a record generator,
+        or with mapped the tuples of pcap.Capture.walk
+        '''
+        for item in self.timed(records, 'framing'):
+            self.records += 1
+            if mapped:
+                self.bytes_read += 16 + item[2]
+            yield item
+
+    def events_of(self, events):
+        '''time and count events by ev_type, calling progress along the way'''
+        clock = time.perf_counter
+        counts = self.events
+        check = self.__check_every__
+        self.started = self.started or clock()
+        last = clock()
+        n = 0
+        try:
+            for ev in self.timed(events, 'decode'):
+                counts[ev.ev_type] += 1
+                n += 1
+                if self.progress is not None and n % check == 0 and clock() - last >= self.interval:
+                    last = clock()
+                    self.elapsed = last - self.started
+                    self.progress(self)
+                yield ev
+        finally:
+            # also when the caller stops early and the generator is closed
+            self.elapsed = clock() - self.started
+
+    def on_error(self, err):
+        self.malformed += 1
+
+    def exclusive(self):
+        '''seconds per stage with the inner stages taken out of the outer ones'''
+        stages = self.stages
+        return {'io': stages['io'],
+                'framing': max(stages['framing'] - stages['io'], 0.0),
+                'decode': max(stages['decode'] - stages['framing'], 0.0),
+                'consumer': max(self.elapsed - stages['decode'], 0.0)}
+
+    def as_dict(self):
+        return {'bytes_read': self.bytes_read, 'records': self.records, 'malformed': self.malformed,
+                'events': dict(self.events), 'elapsed': self.elapsed, 'stages': self.exclusive()}
+
+    def summary(self):
+        elapsed = self.elapsed or float('nan')
+        return (f'{sum(self.events.values())} events, {self.records} records, {self.malformed} malformed, '
+                f'{self.bytes_read / 1e6:.1f} MB in {self.elapsed:.2f}s '
+                f'({sum(self.events.values()) / elapsed:,.0f} events/s, {self.bytes_read / 1e6 / elapsed:.1f} MB/s)')
+
+    def report(self):
+        lines = [self.summary(), f'events per type : {dict(self.events)}']
+        for stage, seconds in self.exclusive().items():
+            share = seconds / self.elapsed * 100 if self.elapsed else 0.0
+            lines.append(f'{stage:<9}: {seconds:.3f}s ({share:.0f}%)')
+        return '\n'.join(lines)
+
+@contextmanager
+def profiling(cpu=True, memory=False, out=None, sort='cumulative', limit=25):
+    '''
+    profile the enclosed block with cProfile, and with tracemalloc when memory
+    is set, and write the top `limit` entries of each to out (stderr by default)
+
+        with profiling(memory=True):
+            list(Reader(f))
+    '''
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    out = sys.stderr if out is None else out
+    profile = cProfile.Profile() if cpu else None
+    if memory:
+        tracemalloc.start()
+    if profile is not None:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            text = io.StringIO()
+            pstats.Stats(profile, stream=text).sort_stats(sort).print_stats(limit)
+            out.write(text.getvalue())
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            out.write(f'traced memory : {current / 1e6:.1f} MB now, {peak / 1e6:.1f} MB at peak\n')
+            for stat in snapshot.statistics('lineno')[:limit]:
+                out.write(f'{stat}\n')
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+KEY_BACKSPACE = 14
+KEY_CAPSLOCK = 58
+KEY_NUMLOCK = 69
+
+# bits of the decoder state: held modifiers, then the lock toggles
+SHIFT, ALTGR, CTRL, ALT, META = 1, 2, 4, 8, 16
+CAPS, NUM = 32, 64
+
+# modifier keys -> state bit
+MODIFIERS = {42: SHIFT,   # KEY_LEFTSHIFT
+             54: SHIFT,   # KEY_RIGHTSHIFT
+             100: ALTGR,  # KEY_RIGHTALT
+             29: CTRL,    # KEY_LEFTCTRL
+             97: CTRL,    # KEY_RIGHTCTRL
+             56: ALT,     # KEY_LEFTALT
+             125: META,   # KEY_LEFTMETA
+             126: META}   # KEY_RIGHTMETA
+
+# keys typing the same character on every layout
+COMMON = {15: ('\t', '\t'),   # KEY_TAB
+          28: ('\n', '\n'),   # KEY_ENTER
+          57: (' ', ' '),     # KEY_SPACE
+          96: ('\n', '\n'),   # KEY_KPENTER
+          55: ('*', '*'),     # KEY_KPASTERISK
+          74: ('-', '-'),     # KEY_KPMINUS
+          78: ('+', '+'),     # KEY_KPPLUS
+          98: ('/', '/')}     # KEY_KPSLASH
+
+# keypad keys typing digits only while NumLock is on
+KEYPAD = {71: '7', 72: '8', 73: '9',
+          75: '4', 76: '5', 77: '6',
+          79: '1', 80: '2', 81: '3',
+          82: '0', 83: '.'}
+
+def _rows(*rows):
+    '''
+    build {code: (normal, shifted, altgr)} from (first code, normal, shifted, altgr) rows,
+    where each string gives one character per key and a space means nothing
+    '''
+    keys = {}
+    for first, normal, shifted, altgr in rows:
+        altgr = altgr.ljust(len(normal))
+        for i, chars in enumerate(zip(normal, shifted, altgr)):
+            keys[first + i] = tuple('' if c == ' ' else c for c in chars)
+    return keys
+
+KEYMAPS = {
+    'us': _rows((2, '1234567890-=', '!@#$%^&*()_+', ''),
+                (16, 'qwertyuiop[]', 'QWERTYUIOP{}', ''),
+                (30, "asdfghjkl;'`", 'ASDFGHJKL:"~', ''),
+                (43, '\\zxcvbnm,./', '|ZXCVBNM<>?', ''),
+                (86, '\\', '|', '')),
+    'jis': _rows((2, '1234567890-^', '!"#$%&\'() =~', ''),
+                 (16, 'qwertyuiop@[', 'QWERTYUIOP`{', ''),
+                 (30, 'asdfghjkl;:', 'ASDFGHJKL+*', ''),
+                 (43, ']zxcvbnm,./', '}ZXCVBNM<>?', ''),
+                 (89, '\\', '_', ''),    # KEY_RO
+                 (124, '\\', '|', '')),  # KEY_YEN
+    'de': _rows((2, '1234567890ß´', '!"§$%&/()=?`', ' ²³   {[]}\\'),
+                (16, 'qwertzuiopü+', 'QWERTZUIOPÜ*', '@ €        ~'),
+                (30, 'asdfghjklöä^', 'ASDFGHJKLÖÄ°', ''),
+                (43, '#yxcvbnm,.-', "'YXCVBNM;:_", '       µ'),
+                (86, '<', '>', '|')),
+}
+
+class TextDecoder:
+    '''
+    rebuild typed text from EV_KEY events with a selectable keymap.
+    Shift, AltGr, CapsLock and NumLock are tracked across events, the right Alt
+    key being AltGr on keymaps with an AltGr level and a plain Alt otherwise;
+    auto-repeat types the key again, and backspace removes the last character
+    not yet handed out, or appears as '\\b' once that text has been flushed.
+    keys pressed while Ctrl, Alt or Meta are held type nothing, and cursor
+    movement is not modelled. every (modifier state, code) pair is resolved to
+    its text once at construction, so each key event costs a list lookup.
+    '''
+
+    def __init__(self, keymap='us', chunk=4096, capslock=False, numlock=True):
+        keys = dict(COMMON)
+        keys.update(KEYMAPS[keymap] if isinstance(keymap, str) else keymap)
+        size = max(max(keys), max(KEYPAD)) + 1
+        self.__modifiers = dict(MODIFIERS)
+        if not any(chars[2] for chars in keys.values() if len(chars) > 2):
+            self.__modifiers[100] = ALT
+        # tables[state][code], for every combination of the state bits
+        self.__tables = []
+        for state in range(NUM << 1):
+            shift = bool(state & SHIFT)
+            table = [''] * size
+            if not state & (CTRL | ALT | META):
+                for code, chars in keys.items():
+                    upper = shift
+                    if state & CAPS and chars[0].upper() == chars[1] != chars[0]:
+                        upper = not upper
+                    if state & ALTGR:
+                        table[code] = chars[2] if len(chars) > 2 else ''
+                    else:
+                        table[code] = chars[1] if upper else chars[0]
+                if state & NUM:
+                    for code, char in KEYPAD.items():
+                        table[code] = char
+            self.__tables.append(table)
+        self.chunk = chunk
+        self.state = (CAPS if capslock else 0) | (NUM if numlock else 0)
+        self.__held = {}
+        self.__buf = []
+
+    def flush(self):
+        text = ''.join(self.__buf)
+        self.__buf = []
+        return text
+
+    def decode(self, events):
+        '''
+        feed InputEvent tuples (other event types are ignored) and yield the
+        text in chunks, at each newline or every `chunk` characters
+        '''
+        tables = self.__tables
+        buf = self.__buf
+        held = self.__held
+        modifiers = self.__modifiers
+        chunk = self.chunk
+        for ev in events:
+            if ev.ev_type != 1:
+                continue
+            code = ev.ev_code
+            value = ev.ev_value
+            mod = modifiers.get(code)
+            if mod is not None:
+                if value:
+                    held[code] = mod
+                else:
+                    held.pop(code, None)
+                mods = 0
+                for bit in held.values():
+                    mods |= bit
+                self.state = self.state & (CAPS | NUM) | mods
+                continue
+            if not value:
+                continue
+            if code == KEY_CAPSLOCK or code == KEY_NUMLOCK:
+                if value == 1:
+                    self.state ^= CAPS if code == KEY_CAPSLOCK else NUM
+                continue
+            if code == KEY_BACKSPACE:
+                if buf and buf[-1] != '\b':
+                    buf.pop()
+                else:
+                    buf.append('\b')
+                continue
+
+            table = tables[self.state]
+            text = table[code] if code < len(table) else ''
+            if text:
+                buf.append(text)
+                if text == '\n' or len(buf) >= chunk:
+                    yield self.flush()
+                    buf = self.__buf
+        if buf:
+            yield self.flush()
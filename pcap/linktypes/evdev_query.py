@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import struct
+
+from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+# offsets of ev_type, ev_code and ev_value in the 24 byte payload
+TYPE_AT, CODE_AT, VALUE_AT = 16, 18, 20
+
+_names = None
+
+def names():
+    '''{name: (ev_type, ev_code or None)} for the type and code names of the lookup tables'''
+    global _names
+    if _names is None:
+        found = {}
+        for t in range(evdev.TYPE_CNT):
+            if t not in evdev.EV_TYPES:
+                continue
+            found.setdefault(evdev.TYPE_NAMES[t], (t, None))
+            for c in range(evdev.EV_TYPES[t].cnt):
+                name = evdev.code_name(t, c)
+                if not name.endswith('_INVALID'):
+                    found.setdefault(name, (t, c))
+        _names = found
+    return _names
+
+def _number(word):
+    try:
+        return int(word, 0)
+    except ValueError:
+        pass
+    if word not in names():
+        raise ValueError(f'unknown event type or code {word}')
+    t, c = names()[word]
+    return t if c is None else c
+
+def _set(spec):
+    '''None, a number, a name or an iterable of those as a frozenset of numbers'''
+    if spec is None:
+        return None
+    if isinstance(spec, (int, str)):
+        spec = [spec]
+    return frozenset(_number(s) if isinstance(s, str) else s for s in spec)
+
+class Query:
+    '''
+    a filter on evdev events by type, code, value and pcap time.
+    types and codes are numbers or names from the lookup tables, or collections
+    of them; a code given by name also selects its type when none is given.
+    value is a number, a collection or a range, e.g. range(1, 3).
+    start and end are in seconds, start inclusive and end exclusive.
+
+        q = Query(ev_code='BTN_LEFT', ev_value=1, start=t1, end=t2)
+        q = Query.parse('BTN_LEFT value=1 start=1600000000 end=1600000060')
+        presses = reader.query(q)             # InputEvent tuples, see Reader.query
+        presses = q.filter(read_array(f))     # numpy masks over a decoded array
+
+    compile() turns the field conditions into comparisons on the raw payload
+    bytes, so records that do not match are skipped without being decoded.
+    '''
+
+    def __init__(self, ev_type=None, ev_code=None, ev_value=None, start=None, end=None):
+        self.ev_type = _set(ev_type)
+        self.ev_code = _set(ev_code)
+        if self.ev_type is None and ev_code is not None:
+            words = [ev_code] if isinstance(ev_code, (int, str)) else ev_code
+            if all(isinstance(w, str) and w in names() for w in words):
+                self.ev_type = frozenset(names()[w][0] for w in words)
+        self.ev_value = ev_value if isinstance(ev_value, range) else _set(ev_value)
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def parse(cls, text):
+        '''
+        build a Query from whitespace separated terms: field=spec with field one of
+        type, code, value, start and end, spec a comma separated list of numbers
+        or names, or lo..hi (inclusive) for value. a bare name stands for type=name
+        or code=name.
+        '''
+        fields = {}
+        for term in text.split():
+            field, sep, spec = term.partition('=')
+            if not sep:
+                if term not in names():
+                    raise ValueError(f'unknown event type or code {term}')
+                field, spec = ('type' if names()[term][1] is None else 'code'), term
+            if field in ('start', 'end'):
+                fields[field] = float(spec)
+            elif field == 'value' and '..' in spec:
+                lo, hi = spec.split('..')
+                fields['ev_value'] = range(int(lo, 0), int(hi, 0) + 1)
+            elif field in ('type', 'code', 'value'):
+                fields['ev_' + field] = fields.get('ev_' + field, ()) + tuple(spec.split(','))
+            else:
+                raise ValueError(f'unknown query field {field}')
+        return cls(**fields)
+
+    def span(self):
+        '''start and end in microseconds, each None when open'''
+        start = None if self.start is None else int(self.start * 1000000)
+        end = None if self.end is None else int(self.end * 1000000)
+        return start, end
+
+    def compile(self, byteorder='<'):
+        '''
+        a predicate on the raw payload bytes for the type, code and value
+        conditions, or None when there are none. it takes the payload, or a
+        mapped capture and the offset of the payload in it.
+        '''
+        tests = []
+        half = struct.Struct(byteorder + 'H')
+        word = struct.Struct(byteorder + 'i')
+        if self.ev_type is not None and self.ev_code is not None:
+            pair = struct.Struct(byteorder + 'HH')
+            tests.append((TYPE_AT, CODE_AT + 2,
+                          frozenset(pair.pack(t, c) for t in self.ev_type for c in self.ev_code)))
+        elif self.ev_type is not None:
+            tests.append((TYPE_AT, TYPE_AT + 2, frozenset(map(half.pack, self.ev_type))))
+        elif self.ev_code is not None:
+            tests.append((CODE_AT, CODE_AT + 2, frozenset(map(half.pack, self.ev_code))))
+
+        values = self.ev_value
+        if values is not None and not isinstance(values, range):
+            tests.append((VALUE_AT, VALUE_AT + 4, frozenset(map(word.pack, values))))
+            values = None
+        if not tests and values is None:
+            return None
+
+        def match(payload, at=0):
+            for lo, hi, accepted in tests:
+                if payload[at + lo:at + hi] not in accepted:
+                    return False
+            return values is None or word.unpack_from(payload, at + VALUE_AT)[0] in values
+        return match
+
+    def mask(self, arr):
+        '''a boolean numpy mask of the matching rows of a read_array or Events.to_array result'''
+        import numpy as np
+
+        mask = np.ones(len(arr), dtype=bool)
+        for name in ('ev_type', 'ev_code'):
+            accepted = getattr(self, name)
+            if accepted is not None:
+                mask &= np.isin(arr[name], list(accepted))
+        if isinstance(self.ev_value, range) and self.ev_value.step == 1:
+            mask &= (arr['ev_value'] >= self.ev_value.start) & (arr['ev_value'] < self.ev_value.stop)
+        elif self.ev_value is not None:
+            mask &= np.isin(arr['ev_value'], list(self.ev_value))
+        start, end = self.span()
+        if start is not None or end is not None:
+            ts = arr['pcap_sec'].astype(np.uint64) * 1000000 + arr['pcap_usec']
+            if start is not None:
+                mask &= ts >= start
+            if end is not None:
+                mask &= ts < end
+        return mask
+
+    def filter(self, arr):
+        return arr[self.mask(arr)]
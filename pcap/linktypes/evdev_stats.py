@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+
+from array import array
+from collections import Counter
+from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+class Histogram:
+    '''
+    counts in `count` fixed buckets of `width` starting at lo, with one more
+    for values below and one for values past the last bucket.
+    histograms with the same buckets add up with +.
+    '''
+
+    def __init__(self, lo=0, width=1, count=100):
+        self.lo = lo
+        self.width = width
+        self.counts = array('Q', bytes(8 * (count + 2)))
+
+    def add(self, x):
+        i = (x - self.lo) // self.width + 1
+        self.counts[min(max(int(i), 0), len(self.counts) - 1)] += 1
+
+    def add_array(self, values):
+        '''add a numpy array of values at once'''
+        import numpy as np
+
+        i = np.clip((values - self.lo) // self.width + 1, 0, len(self.counts) - 1).astype(np.intp)
+        for bucket, n in enumerate(np.bincount(i, minlength=len(self.counts)).tolist()):
+            self.counts[bucket] += n
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def __add__(self, other):
+        if (self.lo, self.width, len(self.counts)) != (other.lo, other.width, len(other.counts)):
+            raise ValueError('histograms with different buckets')
+        total = Histogram(self.lo, self.width, len(self.counts) - 2)
+        total.counts = array('Q', map(sum, zip(self.counts, other.counts)))
+        return total
+
+    def buckets(self):
+        '''(low bound, count) of the inner buckets'''
+        return [(self.lo + i * self.width, n) for i, n in enumerate(self.counts[1:-1])]
+
+class QuantileSketch:
+    '''
+    streaming quantiles of positive values with a relative error of at most
+    `accuracy`: values are counted in buckets growing geometrically, so the
+    size depends on the range of the values and not on their number, and
+    sketches with the same accuracy add up with +.
+    '''
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.__log_gamma = math.log(self.gamma)
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, x):
+        self.count += 1
+        if x <= 0:
+            self.zeros += 1
+        else:
+            self.buckets[math.ceil(math.log(x) / self.__log_gamma)] += 1
+
+    def add_array(self, values):
+        '''add a numpy array of values at once'''
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > 0]
+        self.count += len(values)
+        self.zeros += len(values) - len(positive)
+        keys, counts = np.unique(np.ceil(np.log(positive) / self.__log_gamma), return_counts=True)
+        self.buckets.update(dict(zip(keys.astype(np.int64).tolist(), counts.tolist())))
+
+    def __add__(self, other):
+        if self.accuracy != other.accuracy:
+            raise ValueError('sketches with different accuracy')
+        total = QuantileSketch(self.accuracy)
+        total.buckets = self.buckets + other.buckets
+        total.zeros = self.zeros + other.zeros
+        total.count = self.count + other.count
+        return total
+
+    def quantile(self, q):
+        '''the value at quantile q in [0, 1], or None when empty'''
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0
+        seen = self.zeros
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+class Stats:
+    '''
+    activity statistics of evdev captures: events per type and per (type, code),
+    key presses per code and per minute, the distribution of the time between
+    consecutive records as a histogram (1 ms buckets) and a quantile sketch, and
+    the gaps of at least `gap` seconds. all times are pcap timestamps.
+    statistics of several captures, or of parts of one, add up with +;
+    update() takes events one by one, from_array() a whole read_array result.
+
+        stats = Stats().update(Reader(open('kbd.pcap', 'rb')))
+        total = sum(read_array_parallel(path, reduce=Stats.from_array) for path in paths)
+        total.latency.quantile(0.99)
+    '''
+
+    def __init__(self, gap=60):
+        self.gap = gap
+        self.events = Counter()
+        self.codes = Counter()
+        self.presses = Counter()
+        self.presses_per_minute = Counter()
+        self.histogram = Histogram(0, 1000, 100)
+        self.latency = QuantileSketch()
+        self.gaps = []
+        self.first = None
+        self.last = None
+
+    def update(self, events):
+        '''add InputEvent tuples; returns self'''
+        events_ = self.events
+        codes = self.codes
+        gap = self.gap * 1000000
+        last = self.last
+        for ev in events:
+            ts = ev.pcap_sec * 1000000 + ev.pcap_usec
+            events_[ev.ev_type] += 1
+            codes[ev.ev_type, ev.ev_code] += 1
+            if ev.ev_type == 1 and ev.ev_value == 1:
+                self.presses[ev.ev_code] += 1
+                self.presses_per_minute[ev.pcap_sec // 60 * 60] += 1
+            if last is None:
+                self.first = ts
+            else:
+                self.histogram.add(ts - last)
+                self.latency.add(ts - last)
+                if ts - last >= gap:
+                    self.gaps.append((last, ts - last))
+            last = ts
+        self.last = last
+        return self
+
+    @classmethod
+    def from_array(cls, arr, gap=60):
+        '''statistics of a read_array result, computed with numpy; a reducer for read_array_parallel'''
+        import numpy as np
+
+        self = cls(gap)
+        if not len(arr):
+            return self
+        ev_type = arr['ev_type']
+        types, counts = np.unique(ev_type, return_counts=True)
+        self.events.update(dict(zip(types.tolist(), counts.tolist())))
+        slots, counts = np.unique(ev_type.astype(np.uint32) << 16 | arr['ev_code'], return_counts=True)
+        self.codes.update({(slot >> 16, slot & 0xffff): n for slot, n in zip(slots.tolist(), counts.tolist())})
+        self.presses.update(evdev.key_counts(arr))
+        pressed = (ev_type == 1) & (arr['ev_value'] == 1)
+        minutes, counts = np.unique(arr['pcap_sec'][pressed] // 60 * 60, return_counts=True)
+        self.presses_per_minute.update(dict(zip(minutes.tolist(), counts.tolist())))
+
+        ts = arr['pcap_sec'].astype(np.int64) * 1000000 + arr['pcap_usec']
+        delta = np.diff(ts)
+        self.histogram.add_array(delta)
+        self.latency.add_array(delta)
+        at = np.flatnonzero(delta >= gap * 1000000)
+        self.gaps = list(zip(ts[at].tolist(), delta[at].tolist()))
+        self.first = int(ts[0])
+        self.last = int(ts[-1])
+        return self
+
+    def __add__(self, other):
+        '''
+        combine statistics; when other starts after self ends, the time
+        between the two is counted like that between consecutive records
+        '''
+        total = Stats(self.gap)
+        total.events = self.events + other.events
+        total.codes = self.codes + other.codes
+        total.presses = self.presses + other.presses
+        total.presses_per_minute = self.presses_per_minute + other.presses_per_minute
+        total.histogram = self.histogram + other.histogram
+        total.latency = self.latency + other.latency
+        total.gaps = sorted(self.gaps + other.gaps)
+        if self.last is not None and other.first is not None and other.first >= self.last:
+            delta = other.first - self.last
+            total.histogram.add(delta)
+            total.latency.add(delta)
+            if delta >= self.gap * 1000000:
+                total.gaps.append((self.last, delta))
+                total.gaps.sort()
+        stamps = [t for t in (self.first, other.first) if t is not None]
+        total.first = min(stamps) if stamps else None
+        stamps = [t for t in (self.last, other.last) if t is not None]
+        total.last = max(stamps) if stamps else None
+        return total
+
+    def __radd__(self, other):
+        # lets sum() start from 0
+        return self if other == 0 else NotImplemented
+
+    def as_dict(self):
+        return {'events': {evdev.type_name(t): n for t, n in self.events.items()},
+                'codes': {evdev.code_name(t, c): n for (t, c), n in self.codes.items()},
+                'presses': {evdev.code_name(1, c): n for c, n in self.presses.items()},
+                'presses_per_minute': dict(sorted(self.presses_per_minute.items())),
+                'latency_usec': {q: self.latency.quantile(q) for q in (0.5, 0.9, 0.99, 0.999)},
+                'histogram_usec': self.histogram.buckets(),
+                'gaps': self.gaps,
+                'first': self.first,
+                'last': self.last}
+
+    def show(self):
+        print(f'events per type : {dict((evdev.type_name(t), n) for t, n in self.events.most_common())}')
+        print(f'key presses : {dict((evdev.code_name(1, c), n) for c, n in self.presses.most_common(20))}')
+        for minute, n in sorted(self.presses_per_minute.items()):
+            print(f'  {minute} : {n} presses/min')
+        for q in (0.5, 0.9, 0.99, 0.999):
+            print(f'latency p{q * 100:g} : {self.latency.quantile(q)} usec')
+        print(f'gaps >= {self.gap}s : {len(self.gaps)}')
+        for start, length in self.gaps:
+            print(f'  {start / 1000000:.6f} : {length / 1000000:.3f}s')
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+
+from itertools import islice
+from argparse import ArgumentParser
+from bin_parser.pcap.linktypes import linux_evdev as evdev
+
+EV_SYN, EV_KEY, EV_REL, EV_ABS, EV_MSC = 0x00, 0x01, 0x02, 0x03, 0x04
+MSC_SCAN = 0x04
+REL_X, REL_Y = 0x00, 0x01
+ABS_X, ABS_Y = 0x00, 0x01
+ABS_MT_POSITION_X, ABS_MT_POSITION_Y, ABS_MT_PRESSURE = 0x35, 0x36, 0x3a
+BTN_LEFT, BTN_TOOL_FINGER, BTN_TOUCH = 272, 325, 330
+
+# keys typed in bursts: letters, digits, space, enter, backspace and shift
+TYPED = list(range(16, 26)) + list(range(30, 39)) + list(range(44, 51)) + list(range(2, 12)) + [57] * 6 + [28, 14, 42]
+
+class Timeline:
+    '''
+    an endless stream of synthetic InputEvent tuples mixing the traffic of a
+    keyboard, a touchscreen and a mouse in sessions of a few seconds:
+    typing bursts with scan codes and auto-repeat, one and two finger swipes
+    in multitouch protocol B at 120 Hz, and mouse motion at 125 Hz with clicks.
+    every event belongs to a SYN_REPORT frame, and the pcap timestamp trails
+    the evdev one by the capture delay. the weights set how often each kind
+    of session comes up. the same seed gives the same events.
+    '''
+
+    def __init__(self, seed=0, start=1600000000, keyboard=1, touch=1, mouse=1):
+        self.rand = random.Random(seed)
+        self.now = start * 1000000
+        self.sessions = [self.typing] * keyboard + [self.swipe] * touch + [self.motion] * mouse
+        self.tracking_id = 0
+        self.captured = 0
+
+    def __iter__(self):
+        while True:
+            yield from self.rand.choice(self.sessions)()
+            self.now += self.rand.randint(200000, 3000000)
+
+    def event(self, ev_type, ev_code, ev_value):
+        sec, usec = divmod(self.now, 1000000)
+        # records are captured in order, a little after the kernel stamped them
+        self.captured = max(self.captured, self.now + self.rand.randint(5, 200))
+        pcap_sec, pcap_usec = divmod(self.captured, 1000000)
+        return evdev.InputEvent(pcap_sec, pcap_usec, sec, usec, ev_type, ev_code, ev_value)
+
+    def frame(self, *events):
+        '''one SYN_REPORT frame of (type, code, value) triples at the current time'''
+        for ev_type, ev_code, ev_value in events:
+            yield self.event(ev_type, ev_code, ev_value)
+        yield self.event(EV_SYN, evdev.SYN_REPORT, 0)
+
+    def typing(self):
+        rand = self.rand
+        for _ in range(rand.randint(5, 60)):
+            code = rand.choice(TYPED)
+            scan = 0x70004 + code
+            yield from self.frame((EV_MSC, MSC_SCAN, scan), (EV_KEY, code, 1))
+            hold = rand.randint(40, 140) if rand.random() > 0.01 else rand.randint(600, 1500)
+            if hold > 500:
+                # held down past the repeat delay: auto-repeat every 33 ms
+                self.now += 500000
+                for _ in range((hold - 500) // 33):
+                    self.now += 33000
+                    yield from self.frame((EV_KEY, code, 2))
+            else:
+                self.now += hold * 1000
+            yield from self.frame((EV_MSC, MSC_SCAN, scan), (EV_KEY, code, 0))
+            self.now += rand.randint(30, 250) * 1000
+
+    def swipe(self):
+        rand = self.rand
+        fingers = 1 if rand.random() < 0.7 else 2
+        points = [[rand.randint(0, 4095), rand.randint(0, 4095)] for _ in range(fingers)]
+        steps = [(rand.randint(-40, 40), rand.randint(-40, 40)) for _ in range(fingers)]
+        down = []
+        for slot, (x, y) in enumerate(points):
+            self.tracking_id += 1
+            down += [(EV_ABS, evdev.ABS_MT_SLOT, slot), (EV_ABS, evdev.ABS_MT_TRACKING_ID, self.tracking_id),
+                     (EV_ABS, ABS_MT_POSITION_X, x), (EV_ABS, ABS_MT_POSITION_Y, y),
+                     (EV_ABS, ABS_MT_PRESSURE, rand.randint(20, 80))]
+        yield from self.frame(*down, (EV_KEY, BTN_TOUCH, 1), (EV_KEY, BTN_TOOL_FINGER, 1),
+                              (EV_ABS, ABS_X, points[0][0]), (EV_ABS, ABS_Y, points[0][1]))
+        for _ in range(rand.randint(24, 180)):
+            self.now += 8333
+            moved = []
+            for slot, (point, (dx, dy)) in enumerate(zip(points, steps)):
+                point[0] = min(max(point[0] + dx + rand.randint(-3, 3), 0), 4095)
+                point[1] = min(max(point[1] + dy + rand.randint(-3, 3), 0), 4095)
+                if fingers > 1:
+                    moved.append((EV_ABS, evdev.ABS_MT_SLOT, slot))
+                moved += [(EV_ABS, ABS_MT_POSITION_X, point[0]), (EV_ABS, ABS_MT_POSITION_Y, point[1])]
+            yield from self.frame(*moved, (EV_ABS, ABS_X, points[0][0]), (EV_ABS, ABS_Y, points[0][1]))
+        self.now += 8333
+        up = []
+        for slot in range(fingers):
+            up += [(EV_ABS, evdev.ABS_MT_SLOT, slot), (EV_ABS, evdev.ABS_MT_TRACKING_ID, -1)]
+        yield from self.frame(*up, (EV_KEY, BTN_TOUCH, 0), (EV_KEY, BTN_TOOL_FINGER, 0))
+
+    def motion(self):
+        rand = self.rand
+        dx, dy = rand.randint(-12, 12), rand.randint(-12, 12)
+        for _ in range(rand.randint(30, 400)):
+            self.now += 8000
+            yield from self.frame((EV_REL, REL_X, dx + rand.randint(-2, 2)), (EV_REL, REL_Y, dy + rand.randint(-2, 2)))
+            if rand.random() < 0.01:
+                yield from self.frame((EV_MSC, MSC_SCAN, 0x90001), (EV_KEY, BTN_LEFT, 1))
+                self.now += rand.randint(60, 150) * 1000
+                yield from self.frame((EV_MSC, MSC_SCAN, 0x90001), (EV_KEY, BTN_LEFT, 0))
+
+def generate(fileobj, events=1000000, seed=0, byteorder='<', **weights):
+    '''
+    write a capture of `events` synthetic events to fileobj; weights are the
+    keyboard, touch and mouse arguments of Timeline. returns the number written.
+
+        generate(open('synth.pcap', 'wb'), 10 ** 6, touch=3)
+    '''
+    return evdev.write_events(fileobj, islice(Timeline(seed, **weights), events), byteorder)
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='write a synthetic evdev capture')
+    parser.add_argument('output')
+    parser.add_argument('-n', '--events', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--big-endian', action='store_true')
+    parser.add_argument('--keyboard', type=int, default=1, help='weight of typing sessions')
+    parser.add_argument('--touch', type=int, default=1, help='weight of touch sessions')
+    parser.add_argument('--mouse', type=int, default=1, help='weight of mouse sessions')
+    args = parser.parse_args()
+
+    with open(args.output, 'wb') as f:
+        n = generate(f, args.events, args.seed, '>' if args.big_endian else '<',
+                     keyboard=args.keyboard, touch=args.touch, mouse=args.mouse)
+    print(f'{n} events written to {args.output}')
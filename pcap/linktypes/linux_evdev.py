@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import heapq
+import struct
+
+from array import array
 from ctypes import *
+from collections import Counter, namedtuple
+from itertools import islice
+from operator import itemgetter
 from bin_parser.pcap import pcap
 from argparse import ArgumentParser
 
@@ -19,27 +26,75 @@ class EVDEVPayload(LittleEndianStructure):
                 ('timestamp_usec', c_uint64),
                 ('ev_type', c_uint16),
                 ('ev_code', c_uint16),
-                ('ev_value', c_uint32),
+                ('ev_value', c_int32),
                )
 
+class EVDEVPayloadBE(BigEndianStructure):
+    __pld_len__ = 24
+    _fields_ = EVDEVPayload._fields_
+
+# evdev payloads are written in the byte order of the capturing host, like the pcap headers
+PAYLOADS = {'<': EVDEVPayload, '>': EVDEVPayloadBE}
+
+# the EVDEVPayload layouts, for unpacking payloads in place in a mapped capture
+PAYLOAD_STRUCTS = {order: struct.Struct(order + 'QQHHi') for order in PAYLOADS}
+
+# one pcap record holding one evdev event, as laid out in the file
+RECORD_DTYPE = [('pcap_sec', '<u4'),
+                ('pcap_usec', '<u4'),
+                ('cap_len', '<u4'),
+                ('pkt_len', '<u4'),
+                ('timestamp_sec', '<u8'),
+                ('timestamp_usec', '<u8'),
+                ('ev_type', '<u2'),
+                ('ev_code', '<u2'),
+                ('ev_value', '<i4')]
+
+# one decoded event with the timestamps of both the pcap record and the evdev payload
+InputEvent = namedtuple('InputEvent', ['pcap_sec', 'pcap_usec',
+                                       'timestamp_sec', 'timestamp_usec',
+                                       'ev_type', 'ev_code', 'ev_value'])
+
+# an InputEvent tagged with the position of its capture among the merged ones, see merge_events
+SourcedEvent = namedtuple('SourcedEvent', InputEvent._fields + ('source',))
+
+# the events of one SYN_REPORT frame as (ev_type, ev_code, ev_value) triples, stamped
+# with the SYN_REPORT; resync marks the first frame after events were dropped
+Frame = namedtuple('Frame', ['pcap_sec', 'pcap_usec',
+                             'timestamp_sec', 'timestamp_usec',
+                             'events', 'resync'])
+
 class EVent:
+    '''
+    printable view of one event, built from an InputEvent or an EVDEVPayload.
+    only the evdev fields are kept; hold many events in an Events container instead.
+    '''
+    __slots__ = ('timestamp_sec', 'timestamp_usec', 'ev_type', 'ev_code', 'ev_value')
+
     def __init__(self, pld):
+        self.timestamp_sec = pld.timestamp_sec
+        self.timestamp_usec = pld.timestamp_usec
         self.ev_type = pld.ev_type
         self.ev_code = pld.ev_code
         self.ev_value = pld.ev_value
 
     def __str__(self):
-        return f'(ev_type:{self.ev_type}) not supported'
+        return f'{type_name(self.ev_type)}:\t{code_name(self.ev_type, self.ev_code)}\t{self.ev_value}'
 
 class EV_SYN(EVent):
+    __slots__ = ()
+    cnt = 0x10
     code = ['SYN_REPORT',
-           'SYN_CONFIG', 
-           'SYN_MY_REPORT']
+            'SYN_CONFIG',
+            'SYN_MT_REPORT',
+            'SYN_DROPPED']
 
     def __str__(self):
-        return f'EV_SYN:\t{self.code[self.ev_code]}\t{str(self.ev_value)}'
+        return f'EV_SYN:\t{code_name(0, self.ev_code)}\t{str(self.ev_value)}'
 
 class EV_KEY(EVent):
+    __slots__ = ()
+    cnt = 0x300
     code = {0: ['KEY_RESERVED', '<RESERVED>'],
             1: ['KEY_ESC', '<ESC>'],
             2: ['KEY_1', '1'],
@@ -480,97 +535,990 @@ class EV_KEY(EVent):
             523: ['KEY_NUMERIC_POUND', '<NUMERIC_POUND>'],
             767: ['KEY_MAX', '<MAX>']}
     value = ['Release', 'Push', 'Auto Repeat']
-    
+
     def __str__(self):
-        return f'EV_KEY:\t{self.code[self.ev_code][0]}\t{self.value[self.ev_value]}'
+        value = self.value[self.ev_value] if 0 <= self.ev_value < len(self.value) else str(self.ev_value)
+        return f'EV_KEY:\t{code_name(1, self.ev_code)}\t{value}'
 
 class EV_REL(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+    cnt = 0x10
+    code = {0x00: 'REL_X',
+            0x01: 'REL_Y',
+            0x02: 'REL_Z',
+            0x03: 'REL_RX',
+            0x04: 'REL_RY',
+            0x05: 'REL_RZ',
+            0x06: 'REL_HWHEEL',
+            0x07: 'REL_DIAL',
+            0x08: 'REL_WHEEL',
+            0x09: 'REL_MISC',
+            0x0a: 'REL_RESERVED',
+            0x0b: 'REL_WHEEL_HI_RES',
+            0x0c: 'REL_HWHEEL_HI_RES'}
+
+    def __str__(self):
+        return f'EV_REL:\t{code_name(2, self.ev_code)}\t{self.ev_value:+d}'
+
 class EV_ABS(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+    cnt = 0x40
+    code = {0x00: 'ABS_X',
+            0x01: 'ABS_Y',
+            0x02: 'ABS_Z',
+            0x03: 'ABS_RX',
+            0x04: 'ABS_RY',
+            0x05: 'ABS_RZ',
+            0x06: 'ABS_THROTTLE',
+            0x07: 'ABS_RUDDER',
+            0x08: 'ABS_WHEEL',
+            0x09: 'ABS_GAS',
+            0x0a: 'ABS_BRAKE',
+            0x10: 'ABS_HAT0X',
+            0x11: 'ABS_HAT0Y',
+            0x12: 'ABS_HAT1X',
+            0x13: 'ABS_HAT1Y',
+            0x14: 'ABS_HAT2X',
+            0x15: 'ABS_HAT2Y',
+            0x16: 'ABS_HAT3X',
+            0x17: 'ABS_HAT3Y',
+            0x18: 'ABS_PRESSURE',
+            0x19: 'ABS_DISTANCE',
+            0x1a: 'ABS_TILT_X',
+            0x1b: 'ABS_TILT_Y',
+            0x1c: 'ABS_TOOL_WIDTH',
+            0x20: 'ABS_VOLUME',
+            0x21: 'ABS_PROFILE',
+            0x28: 'ABS_MISC',
+            0x2e: 'ABS_RESERVED',
+            0x2f: 'ABS_MT_SLOT',
+            0x30: 'ABS_MT_TOUCH_MAJOR',
+            0x31: 'ABS_MT_TOUCH_MINOR',
+            0x32: 'ABS_MT_WIDTH_MAJOR',
+            0x33: 'ABS_MT_WIDTH_MINOR',
+            0x34: 'ABS_MT_ORIENTATION',
+            0x35: 'ABS_MT_POSITION_X',
+            0x36: 'ABS_MT_POSITION_Y',
+            0x37: 'ABS_MT_TOOL_TYPE',
+            0x38: 'ABS_MT_BLOB_ID',
+            0x39: 'ABS_MT_TRACKING_ID',
+            0x3a: 'ABS_MT_PRESSURE',
+            0x3b: 'ABS_MT_DISTANCE',
+            0x3c: 'ABS_MT_TOOL_X',
+            0x3d: 'ABS_MT_TOOL_Y'}
+
+    def __str__(self):
+        return f'EV_ABS:\t{code_name(3, self.ev_code)}\t{self.ev_value}'
+
 class EV_MSC(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+    cnt = 0x08
+    code = {0x00: 'MSC_SERIAL',
+            0x01: 'MSC_PULSELED',
+            0x02: 'MSC_GESTURE',
+            0x03: 'MSC_RAW',
+            0x04: 'MSC_SCAN',
+            0x05: 'MSC_TIMESTAMP'}
+
+    def __str__(self):
+        # scan codes are usage ids, e.g. 0x7001e for the 1 key on a USB keyboard
+        value = f'{self.ev_value & 0xffffffff:#x}' if self.ev_code == 0x04 else str(self.ev_value)
+        return f'EV_MSC:\t{code_name(4, self.ev_code)}\t{value}'
+
 class EV_SW(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+    cnt = 0x11
+    code = {0x00: 'SW_LID',
+            0x01: 'SW_TABLET_MODE',
+            0x02: 'SW_HEADPHONE_INSERT',
+            0x03: 'SW_RFKILL_ALL',
+            0x04: 'SW_MICROPHONE_INSERT',
+            0x05: 'SW_DOCK',
+            0x06: 'SW_LINEOUT_INSERT',
+            0x07: 'SW_JACK_PHYSICAL_INSERT',
+            0x08: 'SW_VIDEOOUT_INSERT',
+            0x09: 'SW_CAMERA_LENS_COVER',
+            0x0a: 'SW_KEYPAD_SLIDE',
+            0x0b: 'SW_FRONT_PROXIMITY',
+            0x0c: 'SW_ROTATE_LOCK',
+            0x0d: 'SW_LINEIN_INSERT',
+            0x0e: 'SW_MUTE_DEVICE',
+            0x0f: 'SW_PEN_INSERTED',
+            0x10: 'SW_MACHINE_COVER'}
+    value = ['Off', 'On']
+
+    def __str__(self):
+        return f'EV_SW:\t{code_name(5, self.ev_code)}\t{self.value[self.ev_value != 0]}'
+
 class EV_LED(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+    cnt = 0x10
+    code = {0x00: 'LED_NUML',
+            0x01: 'LED_CAPSL',
+            0x02: 'LED_SCROLLL',
+            0x03: 'LED_COMPOSE',
+            0x04: 'LED_KANA',
+            0x05: 'LED_SLEEP',
+            0x06: 'LED_SUSPEND',
+            0x07: 'LED_MUTE',
+            0x08: 'LED_MISC',
+            0x09: 'LED_MAIL',
+            0x0a: 'LED_CHARGING'}
+    value = ['Off', 'On']
+
+    def __str__(self):
+        return f'EV_LED:\t{code_name(0x11, self.ev_code)}\t{self.value[self.ev_value != 0]}'
+
 class EV_SND(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+    cnt = 0x08
+    code = {0x00: 'SND_CLICK',
+            0x01: 'SND_BELL',
+            0x02: 'SND_TONE'}
+    value = ['Off', 'On']
+
+    def __str__(self):
+        # SND_TONE carries a frequency in Hz, the others switch the sound on or off
+        value = f'{self.ev_value} Hz' if self.ev_code == 0x02 else self.value[self.ev_value != 0]
+        return f'EV_SND:\t{code_name(0x12, self.ev_code)}\t{value}'
+
 class EV_REP(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+    cnt = 0x02
+    code = {0x00: 'REP_DELAY',
+            0x01: 'REP_PERIOD'}
+
+    def __str__(self):
+        return f'EV_REP:\t{code_name(0x14, self.ev_code)}\t{self.ev_value} ms'
+
 class EV_FF(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+    # codes below FF_RUMBLE are ids of uploaded effects
+    cnt = 0x80
+    code = {0x50: 'FF_RUMBLE',
+            0x51: 'FF_PERIODIC',
+            0x52: 'FF_CONSTANT',
+            0x53: 'FF_SPRING',
+            0x54: 'FF_FRICTION',
+            0x55: 'FF_DAMPER',
+            0x56: 'FF_INERTIA',
+            0x57: 'FF_RAMP',
+            0x58: 'FF_SQUARE',
+            0x59: 'FF_TRIANGLE',
+            0x5a: 'FF_SINE',
+            0x5b: 'FF_SAW_UP',
+            0x5c: 'FF_SAW_DOWN',
+            0x5d: 'FF_CUSTOM',
+            0x60: 'FF_GAIN',
+            0x61: 'FF_AUTOCENTER'}
+
+    def __str__(self):
+        # for an effect id the value is a play count, 0 stopping the effect
+        if self.ev_code < 0x50:
+            return f'EV_FF:\teffect {self.ev_code}\t' + (f'play x{self.ev_value}' if self.ev_value else 'stop')
+        return f'EV_FF:\t{code_name(0x15, self.ev_code)}\t{self.ev_value}'
+
 class EV_PWR(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+    cnt = 0x01
+    code = {}
+
 class EV_FF_STATUS(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+    cnt = 0x02
+    code = {0x00: 'FF_STATUS_STOPPED',
+            0x01: 'FF_STATUS_PLAYING'}
+
 class EV_MAX(EVent):
-    # TODO
-    pass
+    # EV_MAX and EV_CNT are bounds of the type range, never sent as events
+    __slots__ = ()
 class EV_CNT(EVent):
-    # TODO
-    pass
+    __slots__ = ()
+
+EV_TYPES = {0x00: EV_SYN,
+            0x01: EV_KEY,
+            0x02: EV_REL,
+            0x03: EV_ABS,
+            0x04: EV_MSC,
+            0x05: EV_SW,
+            0x11: EV_LED,
+            0x12: EV_SND,
+            0x14: EV_REP,
+            0x15: EV_FF,
+            0x16: EV_PWR,
+            0x17: EV_FF_STATUS}
+
+# dense tables compiled from the code tables above. a code past the end of its
+# type's range maps to an INVALID name, e.g. KEY_INVALID, a code inside the range
+# without a name maps to its number, e.g. KEY_0x54, and the codes of an unknown
+# type take the type's name, e.g. EV_0x6 or EV_INVALID past EV_CNT
+TYPE_CNT = 0x20
+CODE_CNT = EV_KEY.cnt
+
+def _compile_tables():
+    types = [f'EV_{t:#x}' for t in range(TYPE_CNT)] + ['EV_INVALID']
+    names = []
+    glyphs = []
+    for t in range(TYPE_CNT + 1):
+        cls = EV_TYPES.get(t)
+        if cls is None:
+            names.extend([types[t]] * (CODE_CNT + 1))
+            glyphs.extend([f'<{types[t]}>'] * (CODE_CNT + 1))
+            continue
+        types[t] = cls.__name__
+        prefix, cnt = cls.__name__[3:], cls.cnt
+        codes = dict(enumerate(cls.code)) if isinstance(cls.code, list) else cls.code
+        for c in range(CODE_CNT + 1):
+            entry = codes.get(c) if c < cnt else None
+            if entry is None:
+                name = f'{prefix}_{c:#x}' if c < cnt else f'{prefix}_INVALID'
+                glyph = f'<{name}>'
+            elif isinstance(entry, str):
+                name = entry
+                glyph = f'<{entry}>'
+            else:
+                name, glyph = entry
+            names.append(name)
+            glyphs.append(glyph)
+    return types, names, glyphs
+
+TYPE_NAMES, CODE_NAMES, CODE_GLYPHS = _compile_tables()
+
+SYN_REPORT = 0x00
+SYN_DROPPED = 0x03
+
+def iter_frames(events, slots=None):
+    '''
+    assemble InputEvent tuples into one Frame per SYN_REPORT.
+    after SYN_DROPPED the kernel's queue overflowed, so everything up to and
+    including the next SYN_REPORT is discarded and the following frame has
+    resync set: its deltas apply to a state the capture no longer knows.
+    events after the last SYN_REPORT form no frame.
+    slots, an MTSlots, is fed the events that are not discarded, so that it
+    holds the multitouch contacts as of each frame when that is yielded:
+
+        slots = MTSlots()
+        for frame in iter_frames(r.iter_events(), slots):
+            print(frame.pcap_sec, slots)
+    '''
+    pending = []
+    dropping = False
+    resync = False
+    for ev in events:
+        if ev.ev_type == 0 and ev.ev_code == SYN_REPORT:
+            if dropping:
+                dropping = False
+                resync = True
+                continue
+            yield Frame(ev.pcap_sec, ev.pcap_usec, ev.timestamp_sec, ev.timestamp_usec,
+                        tuple(pending), resync)
+            pending = []
+            resync = False
+        elif ev.ev_type == 0 and ev.ev_code == SYN_DROPPED:
+            pending = []
+            dropping = True
+        elif not dropping:
+            pending.append((ev.ev_type, ev.ev_code, ev.ev_value))
+            if slots is not None:
+                slots.feed(ev)
+
+ABS_MT_SLOT = 0x2f
+ABS_MT_TRACKING_ID = 0x39
+ABS_MT_TOOL_Y = 0x3d
+
+class MTSlots:
+    '''
+    state of a multitouch device speaking protocol B.
+    feed() every event of the device in order; ABS_MT_SLOT selects the slot the
+    following ABS_MT_* values apply to, a tracking id starts a contact in it and
+    a tracking id of -1 lifts it. contacts maps each active slot to a dict of
+    its latest values by code, including ABS_MT_TRACKING_ID.
+    iter_frames feeds it when given one.
+    '''
+
+    def __init__(self):
+        self.slot = 0
+        self.contacts = {}
+
+    def feed(self, ev):
+        '''update the state with one event and return the slot it applied to, or None'''
+        if ev.ev_type != 3 or not ABS_MT_SLOT <= ev.ev_code <= ABS_MT_TOOL_Y:
+            return None
+        if ev.ev_code == ABS_MT_SLOT:
+            self.slot = ev.ev_value
+        elif ev.ev_code == ABS_MT_TRACKING_ID:
+            if ev.ev_value < 0:
+                self.contacts.pop(self.slot, None)
+            else:
+                self.contacts[self.slot] = {ABS_MT_TRACKING_ID: ev.ev_value}
+        else:
+            contact = self.contacts.get(self.slot)
+            if contact is None:
+                contact = self.contacts[self.slot] = {}
+            contact[ev.ev_code] = ev.ev_value
+        return self.slot
+
+    def __str__(self):
+        return ' '.join(f'[{slot}] ' + ','.join(f'{code_name(3, code)[7:]}={value}' for code, value in contact.items())
+                        for slot, contact in sorted(self.contacts.items()))
+
+def code_slot(ev_type, ev_code):
+    return min(ev_type, TYPE_CNT) * (CODE_CNT + 1) + min(ev_code, CODE_CNT)
+
+def type_name(ev_type):
+    return TYPE_NAMES[min(ev_type, TYPE_CNT)]
+
+def code_name(ev_type, ev_code):
+    return CODE_NAMES[code_slot(ev_type, ev_code)]
+
+def code_glyph(ev_type, ev_code):
+    return CODE_GLYPHS[code_slot(ev_type, ev_code)]
+
+_name_arrays = None
+
+def _table_array(table, np):
+    '''table as a numpy object array, made once for CODE_NAMES and CODE_GLYPHS'''
+    global _name_arrays
+    if table is not CODE_NAMES and table is not CODE_GLYPHS:
+        return np.array(table, dtype=object)
+    if _name_arrays is None:
+        _name_arrays = {id(CODE_NAMES): np.array(CODE_NAMES, dtype=object),
+                        id(CODE_GLYPHS): np.array(CODE_GLYPHS, dtype=object)}
+    return _name_arrays[id(table)]
+
+def take_names(ev_type, ev_code, table=CODE_NAMES):
+    '''
+    vectorized code_name over numpy columns, e.g. take_names(a['ev_type'], a['ev_code'])
+    of a read_array result; pass table=CODE_GLYPHS for glyphs.
+    '''
+    import numpy as np
+
+    slots = (np.minimum(ev_type, TYPE_CNT).astype(np.intp) * (CODE_CNT + 1)
+             + np.minimum(ev_code, CODE_CNT))
+    return np.take(_table_array(table, np), slots)
+
+class Events:
+    '''
+    many decoded events held as parallel array columns named after the fields
+    of InputEvent, 32 bytes per event instead of a tuple or object each.
+    indexing gives InputEvent tuples, slicing gives an Events, and the columns
+    are attributes, e.g. events.ev_code, for bulk work.
+
+        events = Events.from_events(Reader(open('kbd.pcap', 'rb')))
+        events[0].timestamp_sec, len(events), events.nbytes
+    '''
+    __slots__ = InputEvent._fields
+
+    # array typecode of each column, matching RECORD_DTYPE
+    TYPECODES = ('I', 'I', 'Q', 'Q', 'H', 'H', 'i')
+
+    def __init__(self):
+        for name, typecode in zip(self.__slots__, self.TYPECODES):
+            setattr(self, name, array(typecode))
+
+    @classmethod
+    def from_events(cls, events):
+        self = cls()
+        self.extend(events)
+        return self
+
+    @classmethod
+    def from_array(cls, arr):
+        '''take the columns of a read_array result, in either byte order'''
+        self = cls()
+        for name, typecode in zip(self.__slots__, self.TYPECODES):
+            getattr(self, name).frombytes(arr[name].astype(typecode, copy=False).tobytes())
+        return self
+
+    def to_array(self):
+        '''the events as a numpy structured array in native byte order'''
+        import numpy as np
+
+        dtype = np.dtype(list(zip(self.__slots__, self.TYPECODES)))
+        arr = np.empty(len(self), dtype)
+        for name in self.__slots__:
+            arr[name] = np.frombuffer(getattr(self, name), dtype[name])
+        return arr
+
+    def append(self, ev):
+        for name, value in zip(self.__slots__, ev):
+            getattr(self, name).append(value)
+
+    def extend(self, events):
+        # one bound append per column, looked up once for the whole batch
+        appends = [getattr(self, name).append for name in self.__slots__]
+        for ev in events:
+            for append, value in zip(appends, ev):
+                append(value)
+
+    def column(self, name):
+        return getattr(self, name)
+
+    @property
+    def nbytes(self):
+        return sum(len(col) * col.itemsize for col in map(self.column, self.__slots__))
+
+    def __len__(self):
+        return len(self.ev_type)
+
+    def __iter__(self):
+        return map(InputEvent._make, zip(*map(self.column, self.__slots__)))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            part = type(self).__new__(type(self))
+            for name in self.__slots__:
+                setattr(part, name, getattr(self, name)[i])
+            return part
+        return InputEvent._make(getattr(self, name)[i] for name in self.__slots__)
 
 class Reader:
 
-    EV = [EV_SYN, EV_KEY, EV_REL, EV_ABS, EV_MSC, EV_SW, EV_LED, EV_SND, EV_REP, EV_FF, EV_PWR, EV_FF_STATUS, EV_MAX, EV_CNT]
+    # event classes indexed by ev_type, with a trailing slot for out of range types
+    EV = [EV_TYPES.get(t, EVent) for t in range(TYPE_CNT + 1)]
 
-    def __init__(self, fileobj):
+    def __init__(self, fileobj, strict=False, capture=None, instruments=None):
+        '''
+        the capture may be little or big endian, microsecond or nanosecond pcap, or pcapng,
+        and gzip, xz or zstd compressed. malformed records are counted in self.malformed
+        and skipped, or raised as pcap.MalformedRecord when strict is set.
+        capture is the pcap.Capture of fileobj when its header was already read.
+        a regular classic pcap file is decoded in place over its mapping, other
+        captures, pipes and follow mode are read record by record.
+        instruments, a pcap.instrument.Instruments, counts and times the reads
+        of iter_events and query; without it they run unwrapped.
+        '''
+        # a compressed capture is read through its decompressed stream
+        fileobj = pcap.decompress(fileobj) if capture is None else capture.fileobj
         self.__f = fileobj
-        self.__fh = pcap.PcapHeader()
-        self.__ph = pcap.PacketHeader()
-        self.__pld = EVDEVPayload()
-        self.__f.readinto(self.__fh)
-    
+        self.__inst = instruments
+        if instruments is not None:
+            if capture is None:
+                fileobj = instruments.wrap_file(fileobj)
+            else:
+                capture.fileobj = instruments.wrap_file(capture.fileobj)
+        self.__cap = pcap.Capture(fileobj) if capture is None else capture
+        self.__fh = self.__cap.header
+        self.header = self.__fh
+        self.__strict = strict
+        self.__index = None
+        self.malformed = 0
+
+    def to_events(self):
+        '''all events from the current position as a compact Events container'''
+        return Events.from_events(self.iter_events())
+
+    def to_array(self, workers=None):
+        if workers:
+            return read_array_parallel(self.__f.name, workers)
+        return read_array(self.__f)
+
+    def __iter__(self):
+        return self.iter_events()
+
+    def rewind(self):
+        self.__cap.rewind()
+
+    def index(self, sidecar=False):
+        '''
+        build the record offset index, or extend it when the file has grown.
+        with sidecar it is also cached next to the capture as <name>.idx, from
+        then on. the position of the reader is kept.
+        '''
+        path = self.__f.name + pcap.RecordIndex.SUFFIX if sidecar else None
+        if self.__index is None:
+            if self.__cap.pcapng:
+                raise ValueError('random access needs a classic pcap file')
+            self.__index = pcap.RecordIndex(self.__fh, path)
+        elif path is not None:
+            self.__index.sidecar = path
+        # files without a descriptor are read whole to be scanned
+        position = self.__f.tell()
+        try:
+            return self.__index.update(self.__f)
+        finally:
+            self.__f.seek(position)
+
+    def __getitem__(self, i):
+        '''
+        the event of record i, or the list of the events of a slice of records.
+        a record holding no event raises pcap.MalformedRecord, in a slice it is
+        counted and skipped like in iter_events, or raised when strict is set
+        '''
+        index = self.index() if self.__index is None else self.__index
+        if isinstance(i, slice):
+            events = []
+            for offset in index.offsets[i]:
+                try:
+                    events.append(self.__event_at(offset))
+                except pcap.MalformedRecord as err:
+                    self.__on_error(err)
+            return events
+        if i < 0:
+            i += len(index)
+        if not 0 <= i < len(index):
+            raise IndexError('record index out of range')
+        return self.__event_at(index.offsets[i])
+
+    def __event_at(self, offset):
+        '''decode the indexed record at offset, leaving the file positioned after it'''
+        f, ph = self.__f, self.__fh.packet_header()
+        f.seek(offset)
+        if f.readinto(ph) != len(ph):
+            raise pcap.MalformedRecord('truncated record header', offset)
+        payload_cls = PAYLOADS[self.__cap.byteorder]
+        reason = pcap._check_record(ph.cap_len, ph.pkt_len, self.__fh.snap_len, payload_cls.__pld_len__)
+        if reason is None:
+            payload = f.read(ph.cap_len)
+            if len(payload) != ph.cap_len:
+                reason = f'truncated payload ({len(payload)} of {ph.cap_len} bytes)'
+        if reason is not None:
+            raise pcap.MalformedRecord(reason, offset)
+        pld = payload_cls.from_buffer_copy(payload)
+        return InputEvent(ph.timestamp_sec, ph.timestamp_usec // (1000 if self.__cap.nsec else 1),
+                          pld.timestamp_sec, pld.timestamp_usec,
+                          pld.ev_type, pld.ev_code, pld.ev_value)
+
+    def seek_to_time(self, ts):
+        '''
+        position the reader on the first record at or after ts, in seconds,
+        and return its index. the next iter_events() call starts from there.
+        '''
+        index = self.index() if self.__index is None else self.__index
+        i = index.bisect(ts)
+        self.__f.seek(index.offsets[i] if i < len(index) else index.end)
+        return i
+
+    def __on_error(self, err):
+        self.malformed += 1
+        if self.__inst is not None:
+            self.__inst.on_error(err)
+        if self.__strict:
+            raise err
+
+    def __records(self, min_len, follow=None):
+        records = self.__cap.records(self.__on_error, min_len=min_len, follow=follow)
+        return records if self.__inst is None else self.__inst.records_of(records)
+
+    def __mapping(self, follow=None):
+        '''the mapped file to walk, or None when the records are read: pipes, compressed files and follow mode'''
+        return None if follow is not None else self.__cap.mapping()
+
+    def __walk(self, buf):
+        records = self.__cap.walk(buf, self.__on_error, min_len=EVDEVPayload.__pld_len__)
+        return records if self.__inst is None else self.__inst.records_of(records, mapped=True)
+
+    def iter_events(self, ev_type=None, ev_code=None, ev_value=None, follow=None):
+        '''
+        yield InputEvent tuples lazily from the current position of the file,
+        keeping only the events whose type, code and value match the given ones.
+        pcap_usec is in microseconds whatever the resolution of the capture.
+        follow is an optional pcap.Follower waiting for appended records.
+        '''
+        events = self.__iter_events(ev_type, ev_code, ev_value, follow)
+        return events if self.__inst is None else self.__inst.events_of(events)
+
+    def __iter_events(self, ev_type, ev_code, ev_value, follow):
+        div = 1000 if self.__cap.nsec else 1
+        buf = self.__mapping(follow)
+        if buf is not None:
+            unpack = PAYLOAD_STRUCTS[self.__cap.byteorder].unpack_from
+            # InputEvent(...) goes through the Python level __new__ of namedtuple
+            new = tuple.__new__
+            for sec, frac, _, at in self.__walk(buf):
+                pld = unpack(buf, at)
+                if ev_type is not None and pld[2] != ev_type:
+                    continue
+                if ev_code is not None and pld[3] != ev_code:
+                    continue
+                if ev_value is not None and pld[4] != ev_value:
+                    continue
+                yield new(InputEvent, (sec, frac // div) + pld)
+            return
+
+        payload_cls = PAYLOADS[self.__cap.byteorder]
+        records = self.__records(payload_cls.__pld_len__, follow)
+        for ph, payload in records:
+            pld = payload_cls.from_buffer_copy(payload)
+            if ev_type is not None and pld.ev_type != ev_type:
+                continue
+            if ev_code is not None and pld.ev_code != ev_code:
+                continue
+            if ev_value is not None and pld.ev_value != ev_value:
+                continue
+            yield InputEvent(ph.timestamp_sec, ph.timestamp_usec // div,
+                             pld.timestamp_sec, pld.timestamp_usec,
+                             pld.ev_type, pld.ev_code, pld.ev_value)
+
+    def query(self, q):
+        '''
+        yield the InputEvent tuples matching q, an evdev_query.Query or its text
+        form, from the current position of the file. types, codes and values are
+        compared on the raw payload bytes and only matching records are decoded.
+        when start is set and the index was built, the file is first positioned
+        with seek_to_time; the records are taken to be in time order, so the
+        iteration stops at the first one at or past end.
+
+            r.index(sidecar=True)
+            presses = list(r.query('BTN_LEFT value=1 start=1600000000 end=1600000060'))
+        '''
+        from bin_parser.pcap.linktypes.evdev_query import Query
+
+        if isinstance(q, str):
+            q = Query.parse(q)
+        events = self.__query(q)
+        return events if self.__inst is None else self.__inst.events_of(events)
+
+    def __query(self, q):
+        if q.start is not None and self.__index is not None:
+            self.seek_to_time(q.start)
+        match = q.compile(self.__cap.byteorder)
+        start, end = q.span()
+        timed = start is not None or end is not None
+        div = 1000 if self.__cap.nsec else 1
+        buf = self.__mapping()
+        if buf is not None:
+            unpack = PAYLOAD_STRUCTS[self.__cap.byteorder].unpack_from
+            new = tuple.__new__
+            for sec, frac, _, at in self.__walk(buf):
+                if timed:
+                    ts = sec * 1000000 + frac // div
+                    if start is not None and ts < start:
+                        continue
+                    if end is not None and ts >= end:
+                        break
+                if match is not None and not match(buf, at):
+                    continue
+                yield new(InputEvent, (sec, frac // div) + unpack(buf, at))
+            return
+
+        payload_cls = PAYLOADS[self.__cap.byteorder]
+        for ph, payload in self.__records(payload_cls.__pld_len__):
+            if timed:
+                ts = ph.timestamp_sec * 1000000 + ph.timestamp_usec // div
+                if start is not None and ts < start:
+                    continue
+                if end is not None and ts >= end:
+                    break
+            if match is not None and not match(payload):
+                continue
+            pld = payload_cls.from_buffer_copy(payload)
+            yield InputEvent(ph.timestamp_sec, ph.timestamp_usec // div,
+                             pld.timestamp_sec, pld.timestamp_usec,
+                             pld.ev_type, pld.ev_code, pld.ev_value)
+
+    def follow(self, callback=None, idle_timeout=None, ev_type=None, ev_code=None, ev_value=None):
+        '''
+        iterate like iter_events but keep waiting for records appended to a live
+        capture, as tail -f does; a partially written record is picked up once complete.
+        with callback, each event is passed to it instead and the call returns
+        after idle_timeout seconds without new events (never by default).
+        '''
+        events = self.iter_events(ev_type, ev_code, ev_value, pcap.Follower(self.__f, idle_timeout))
+        if callback is None:
+            return events
+        for ev in events:
+            callback(ev)
+
+    def iter_frames(self, slots=None):
+        return iter_frames(self.iter_events(), slots)
+
+    def iter_text(self, keymap='us', chunk=4096):
+        '''typed text in chunks, see evdev_keymap.TextDecoder'''
+        from bin_parser.pcap.linktypes.evdev_keymap import TextDecoder
+
+        return TextDecoder(keymap, chunk).decode(self.iter_key_events())
+
+    def iter_key_events(self):
+        return self.iter_events(ev_type=1)
+
+    def iter_key_presses(self):
+        return self.iter_events(ev_type=1, ev_value=1)
+
     def show_events(self, n):
-        for _ in range(n):
-            if not self.__f.readable():
-                break
-
-            self.__f.readinto(self.__ph)
-            self.__f.readinto(self.__pld)
-            event = self.EV[self.__pld.ev_type](self.__pld)
-            print(event)
-            
-        self.__f.seek(0)
-    
-    def show_key_events(self,n):
-        idx = 0
-        while idx < n:
-            if not self.__f.readable():
-                break
-            
-            self.__f.readinto(self.__ph)
-            self.__f.readinto(self.__pld)
-            if self.__pld.ev_type == 1:
-                event = self.EV[self.__pld.ev_type](self.__pld)
-                print(event)
-        self.__f.seek(0)
+        for ev in islice(self.iter_events(), n):
+            print(self.EV[min(ev.ev_type, TYPE_CNT)](ev))
+
+    def show_key_events(self, n):
+        for ev in islice(self.iter_key_events(), n):
+            print(EV_KEY(ev))
 
     def get_key_inputs(self, n):
-        idx = 0
-        while idx < n:
-            if not self.__f.readable():
-                break
-            
-            self.__f.readinto(self.__ph)
-            self.__f.readinto(self.__pld)
-            if self.__pld.ev_type == 1 and self.__pld.ev_value == 1:
-                event = self.EV[self.__pld.ev_type](self.__pld)
-                print(event.code[event.ev_code][1])
-
-        self.__f.seek(0)
+        for ev in islice(self.iter_key_presses(), n):
+            print(code_glyph(1, ev.ev_code))
+
+
+async def aiter_events(stream, on_error=None, ev_type=None, ev_code=None, ev_value=None):
+    '''
+    decode evdev events from an asyncio.StreamReader as an async iterator of
+    InputEvent tuples, for captures streamed over pipes and sockets.
+    malformed records are passed to on_error as pcap.MalformedRecord.
 
+        reader, _ = await asyncio.open_unix_connection('/run/evdev.sock')
+        async for ev in aiter_events(reader):
+            ...
+    '''
+    cap = await pcap.StreamCapture.open(stream)
+    payload_cls = PAYLOADS[cap.byteorder]
+    div = 1000 if cap.nsec else 1
+    async for ph, payload in cap.records(on_error, min_len=payload_cls.__pld_len__):
+        pld = payload_cls.from_buffer_copy(payload)
+        if ev_type is not None and pld.ev_type != ev_type:
+            continue
+        if ev_code is not None and pld.ev_code != ev_code:
+            continue
+        if ev_value is not None and pld.ev_value != ev_value:
+            continue
+        yield InputEvent(ph.timestamp_sec, ph.timestamp_usec // div,
+                         pld.timestamp_sec, pld.timestamp_usec,
+                         pld.ev_type, pld.ev_code, pld.ev_value)
+
+def read_array(fileobj, chunk=1 << 16):
+    '''
+    decode a whole capture into a numpy structured array of RECORD_DTYPE,
+    in the byte order of the file and with pcap_usec in microseconds.
+    when every record is a bare 24 byte payload the result is a strided view
+    over the mapped file, otherwise the records are gathered chunk by chunk.
+    records too short to hold a payload are dropped. pcapng, compressed and
+    in-memory captures, which cannot be mapped, are decoded record by record.
+
+        a = read_array(open('kbd.pcap', 'rb'))
+        presses = a[(a['ev_type'] == 1) & (a['ev_value'] == 1)]
+    '''
+    import numpy as np
+
+    fileobj.seek(0)
+    cap = pcap.Capture(fileobj)
+    buf = cap.mapping()
+    if buf is None:
+        parts = list(_iter_arrays_slow(cap, chunk, np))
+        return np.concatenate(parts) if parts else np.empty(0, RECORD_DTYPE)
+
+    header = cap.header
+    return _decode_range(buf, header, pcap.PcapHeader.__hdr_len__, len(buf), chunk, np)
+
+def _decode_range(buf, header, start, end, chunk, np):
+    dtype = np.dtype(RECORD_DTYPE).newbyteorder(header.byteorder)
+    size = max(end - start, 0)
+    arr = None
+    if size % dtype.itemsize == 0:
+        arr = np.frombuffer(buf, dtype, size // dtype.itemsize, start)
+        if not (arr['cap_len'] == EVDEVPayload.__pld_len__).all():
+            arr = None
+
+    if arr is None:
+        offsets = []
+        offset = start
+        for pkth, _ in pcap.iter_records(buf, start, end, header.packet_header):
+            if pkth.cap_len >= EVDEVPayload.__pld_len__:
+                offsets.append(offset)
+            offset += len(pkth) + pkth.cap_len
+        arr = _gather(buf, np.array(offsets, dtype=np.int64), dtype, chunk, np)
+
+    return _fix_part(arr, header)
+
+def _gather(buf, offsets, dtype, chunk, np):
+    '''copy the records starting at offsets into one array, chunk rows at a time'''
+    raw = np.frombuffer(buf, np.uint8)
+    arr = np.empty(len(offsets), dtype)
+    cols = np.arange(dtype.itemsize)
+    for i in range(0, len(offsets), chunk):
+        rows = offsets[i:i + chunk, None] + cols
+        arr[i:i + chunk] = raw[rows].view(dtype)[:, 0]
+    return arr
+
+def iter_arrays(fileobj, chunk=1 << 16):
+    '''
+    decode a capture like read_array, but as a sequence of arrays of at most
+    chunk records each, so that captures of any size go through with bounded memory.
+    fixed size records are sliced straight out of the mapped file, other
+    captures are walked once and gathered chunk by chunk. captures that cannot
+    be mapped are read record by record, compressed ones without ever holding
+    the whole decompressed file.
+
+        for part in iter_arrays(open('kbd.pcap', 'rb')):
+            ...
+    '''
+    import numpy as np
+
+    fileobj.seek(0)
+    cap = pcap.Capture(fileobj)
+    buf = cap.mapping()
+    if buf is None:
+        yield from _iter_arrays_slow(cap, chunk, np)
+        return
+
+    header = cap.header
+    dtype = np.dtype(RECORD_DTYPE).newbyteorder(header.byteorder)
+    start = pcap.PcapHeader.__hdr_len__
+    size = max(len(buf) - start, 0)
+    if size and size % dtype.itemsize == 0:
+        count = size // dtype.itemsize
+        cap_len = np.ndarray(count, dtype['cap_len'], buf, start + dtype.fields['cap_len'][1], dtype.itemsize)
+        if (cap_len == EVDEVPayload.__pld_len__).all():
+            step = chunk * dtype.itemsize
+            for offset in range(start, len(buf), step):
+                yield _decode_range(buf, header, offset, min(offset + step, len(buf)), chunk, np)
+            return
+
+    offsets = []
+    offset = start
+    for pkth, _ in pcap.iter_records(buf, start, None, header.packet_header):
+        if pkth.cap_len >= EVDEVPayload.__pld_len__:
+            offsets.append(offset)
+            if len(offsets) == chunk:
+                yield _fix_part(_gather(buf, np.array(offsets, dtype=np.int64), dtype, chunk, np), header)
+                offsets = []
+        offset += len(pkth) + pkth.cap_len
+    if offsets:
+        yield _fix_part(_gather(buf, np.array(offsets, dtype=np.int64), dtype, chunk, np), header)
+
+def _fix_part(arr, header):
+    if header.nsec:
+        arr['pcap_usec'] //= 1000
+    return arr
+
+def _iter_arrays_slow(cap, chunk, np):
+    payload_cls = PAYLOADS[cap.byteorder]
+    div = 1000 if cap.nsec else 1
+    rows = []
+    for ph, payload in cap.records(min_len=payload_cls.__pld_len__):
+        pld = payload_cls.from_buffer_copy(payload)
+        rows.append((ph.timestamp_sec, ph.timestamp_usec // div, ph.cap_len, ph.pkt_len,
+                     pld.timestamp_sec, pld.timestamp_usec, pld.ev_type, pld.ev_code, pld.ev_value))
+        if len(rows) == chunk:
+            yield np.array(rows, np.dtype(RECORD_DTYPE))
+            rows = []
+    if rows:
+        yield np.array(rows, np.dtype(RECORD_DTYPE))
+
+def _split_ranges(fileobj, buf, header, parts, np):
+    '''split the records into about `parts` byte ranges that start and end on record boundaries'''
+    dtype = np.dtype(RECORD_DTYPE).newbyteorder(header.byteorder)
+    start = pcap.PcapHeader.__hdr_len__
+    size = max(len(buf) - start, 0)
+    if size and size % dtype.itemsize == 0:
+        count = size // dtype.itemsize
+        cap_len = np.ndarray(count, dtype['cap_len'], buf, start + dtype.fields['cap_len'][1], dtype.itemsize)
+        if (cap_len == EVDEVPayload.__pld_len__).all():
+            bounds = start + np.linspace(0, count, parts + 1).astype(np.int64) * dtype.itemsize
+            return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    index = pcap.RecordIndex(header).update(fileobj)
+    offsets = index.offsets.tolist() + [index.end]
+    picks = np.linspace(0, len(index), parts + 1).astype(np.int64)
+    return [(offsets[a], offsets[b]) for a, b in zip(picks[:-1], picks[1:])]
+
+def _decode_part(path, start, end, reduce):
+    import numpy as np
+
+    with open(path, 'rb') as f:
+        buf = pcap.map_file(f)
+    header = pcap.header_class(buf).from_buffer_copy(buf)
+    arr = _decode_range(buf, header, start, end, 1 << 16, np)
+    return arr if reduce is None else reduce(arr)
+
+def read_array_parallel(path, workers=None, reduce=None):
+    '''
+    decode an uncompressed classic pcap file like read_array, spread over worker processes.
+    the file is split into byte ranges on record boundaries, found from the
+    fixed record size or from a RecordIndex, and every worker maps the same
+    file. the parts are merged back in timestamp order.
+    with reduce, each worker returns reduce(part) instead of its events and the
+    results are added up, so only aggregates cross the process boundary:
+
+        counts = read_array_parallel('kbd.pcap', reduce=key_counts)
+    '''
+    import os
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import reduce as fold
+    from operator import add
+
+    workers = workers or os.cpu_count()
+    with open(path, 'rb') as f:
+        cap = pcap.Capture(f)
+        # workers map the file themselves, a compressed one would be decompressed by each
+        buf = cap.mapping()
+        if buf is None:
+            raise ValueError('parallel decoding needs an uncompressed classic pcap file')
+        header = cap.header
+        ranges = _split_ranges(f, buf, header, workers, np)
+    del buf, cap
+
+    with ProcessPoolExecutor(workers) as pool:
+        parts = list(pool.map(_decode_part, [path] * len(ranges),
+                              *zip(*ranges), [reduce] * len(ranges)))
+    if reduce is not None:
+        return fold(add, parts)
+
+    arr = np.concatenate(parts)
+    ts = arr['pcap_sec'].astype(np.uint64) * 1000000 + arr['pcap_usec']
+    if len(ts) and (ts[1:] < ts[:-1]).any():
+        arr = arr[np.argsort(ts, kind='stable')]
+    return arr
+
+def key_counts(arr):
+    '''presses per EV_KEY code as a Counter, a reducer for read_array_parallel'''
+    import numpy as np
+
+    presses = arr['ev_code'][(arr['ev_type'] == 1) & (arr['ev_value'] == 1)]
+    codes, counts = np.unique(presses, return_counts=True)
+    return Counter(dict(zip(codes.tolist(), counts.tolist())))
+
+def _tagged(events, source):
+    for ev in events:
+        yield SourcedEvent(*ev, source)
+
+def merge_events(readers, key='pcap'):
+    '''
+    merge the events of several Readers, or other iterables of InputEvent, into
+    one timeline ordered by the pcap record timestamps, or by the evdev payload
+    timestamps with key='evdev'. each input must be in that order itself.
+    a heap holds one pending event per input, so memory does not grow with the
+    captures, and events with equal timestamps keep the order of the inputs.
+    events come out as SourcedEvent tuples whose source is the position of their
+    reader in readers, ready for write_events or iter_event_arrays.
+
+        readers = [Reader(open(path, 'rb')) for path in ('kbd.pcap', 'mouse.pcap')]
+        write_events(open('all.pcap', 'wb'), merge_events(readers))
+    '''
+    if key == 'pcap':
+        stamp = itemgetter(0, 1)
+    elif key == 'evdev':
+        stamp = itemgetter(2, 3)
+    else:
+        raise ValueError(f'unknown merge key {key}')
+    return heapq.merge(*(_tagged(events, i) for i, events in enumerate(readers)), key=stamp)
+
+def iter_event_arrays(events, chunk=1 << 16):
+    '''
+    numpy structured arrays of at most chunk events from InputEvent or
+    SourcedEvent tuples, e.g. to hand merged events to export.write
+    '''
+    import numpy as np
+
+    columns = dict(RECORD_DTYPE, source='<u2')
+    events = iter(events)
+    while True:
+        part = list(islice(events, chunk))
+        if not part:
+            return
+        yield np.array(part, np.dtype([(name, columns[name]) for name in type(part[0])._fields]))
+
+def write_events(fileobj, events, byteorder='<'):
+    '''
+    write InputEvent tuples, e.g. filtered or transformed ones, as a new evdev
+    capture with microsecond timestamps. returns the number of records written.
+    '''
+    record = struct.Struct(byteorder + 'IIIIQQHHi')
+    pld_len = EVDEVPayload.__pld_len__
+    with pcap.Writer(fileobj, pcap.LINKTYPE_LINUX_EVDEV, byteorder) as w:
+        for ev in events:
+            w.write_raw(record.pack(ev.pcap_sec, ev.pcap_usec, pld_len, pld_len,
+                                    ev.timestamp_sec, ev.timestamp_usec,
+                                    ev.ev_type, ev.ev_code, ev.ev_value))
+    return w.records
 
 def show_evdev_payload(evdev_payload):
     print(f'timestamp_sec : {evdev_payload.timestamp_sec}')
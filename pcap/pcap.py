@@ -2,12 +2,48 @@
 # -*- coding: utf-8 -*-
 
 import io
+import os
+import mmap
+import stat
+import time
+import select
+import struct
+import queue
+import importlib
+import threading
 
+from array import array
+from bisect import bisect_left
+from functools import partial
 from ctypes import *
 from argparse import ArgumentParser
 
+MAGIC_USEC = 0xa1b2c3d4
+MAGIC_NSEC = 0xa1b23c4d
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+PCAPNG_BYTE_ORDER = 0x1a2b3c4d
+PCAPNG_SHB = 0x0a0d0d0a
+
+LINKTYPE_LINUX_EVDEV = 216
+
+# link-layer header type -> module decoding its payloads, imported on first use.
+# a decoder module provides Reader(fileobj, capture=None, ...), iterating over events with pcap_sec,
+# pcap_usec and ev_type fields and counting skipped records in malformed, and may
+# provide iter_arrays(fileobj, chunk) yielding numpy structured arrays of its RECORD_DTYPE
+LINKTYPES = {LINKTYPE_LINUX_EVDEV: 'bin_parser.pcap.linktypes.linux_evdev'}
+
+def register(link_type, module_name):
+    '''add or replace the decoder module of a link type'''
+    LINKTYPES[link_type] = module_name
+
+def decoder(link_type):
+    '''the decoder module of a link type, or None when there is none'''
+    module_name = LINKTYPES.get(link_type)
+    return None if module_name is None else importlib.import_module(module_name)
+
 class PcapHeader(LittleEndianStructure):
     __hdr_len__ = 24
+    byteorder = '<'
     _fields_ = (
         ('magic_num', c_uint32), # magic number
         ('major_ver', c_uint16), # major version
@@ -18,6 +54,11 @@ class PcapHeader(LittleEndianStructure):
         ('link_type', c_uint32) # link-layer header type
     )
 
+    @property
+    def nsec(self):
+        '''True when timestamp_usec of the records holds nanoseconds'''
+        return self.magic_num == MAGIC_NSEC
+
 class PacketHeader(LittleEndianStructure):
     __hdr_len__ = 16
     _fields_ = (
@@ -30,6 +71,950 @@ class PacketHeader(LittleEndianStructure):
     def __len__(self):
         return self.__hdr_len__
 
+class PcapHeaderBE(BigEndianStructure):
+    __hdr_len__ = 24
+    byteorder = '>'
+    _fields_ = PcapHeader._fields_
+    nsec = PcapHeader.nsec
+
+class PacketHeaderBE(BigEndianStructure):
+    __hdr_len__ = 16
+    _fields_ = PacketHeader._fields_
+    __len__ = PacketHeader.__len__
+
+PcapHeader.packet_header = PacketHeader
+PcapHeaderBE.packet_header = PacketHeaderBE
+
+# raw leading bytes of a classic pcap file -> header class reading it in the right byte order
+FORMATS = {
+    b'\xd4\xc3\xb2\xa1': PcapHeader,
+    b'\x4d\x3c\xb2\xa1': PcapHeader,
+    b'\xa1\xb2\xc3\xd4': PcapHeaderBE,
+    b'\xa1\xb2\x3c\x4d': PcapHeaderBE,
+}
+
+def header_class(magic):
+    try:
+        return FORMATS[bytes(magic[:4])]
+    except KeyError:
+        raise ValueError(f'unknown magic number {bytes(magic[:4]).hex()}') from None
+
+# largest cap_len accepted when the global header gives no usable snap_len (same as libpcap)
+MAX_SNAPLEN = 262144
+
+class MalformedRecord(ValueError):
+    def __init__(self, reason, offset):
+        super().__init__(reason if offset is None else f'{reason} at offset {offset}')
+        self.reason = reason
+        self.offset = offset
+
+def read_records(fileobj, snap_len=0, on_error=None, offset=None, min_len=0,
+                 packet_header=PacketHeader, follow=None):
+    '''
+    frame the records of a stream positioned just after the global header.
+    yields (PacketHeader, bytes) pairs until the end of the stream.
+    records whose cap_len exceeds snap_len or pkt_len, or falls short of min_len,
+    are skipped, while a cap_len beyond MAX_SNAPLEN, a truncated record or a
+    damaged compressed stream means the framing is lost and ends the iteration. each of these is passed to
+    on_error as a MalformedRecord, which may raise it to stop at the first one.
+    with follow, a Follower, the end of the file is not the end of the stream:
+    a short read goes back to the start of the record and waits for more data.
+    '''
+    if offset is None:
+        try:
+            offset = fileobj.tell()
+        except (OSError, AttributeError):
+            offset = PcapHeader.__hdr_len__
+    hdr_len = PacketHeader.__hdr_len__
+    limit = max(snap_len, MAX_SNAPLEN)
+    waited = False
+    while True:
+        pkth = packet_header()
+        try:
+            n = fileobj.readinto(pkth) or 0
+            if n == hdr_len and pkth.cap_len <= limit:
+                payload = fileobj.read(pkth.cap_len)
+        except MalformedRecord as err:
+            # a damaged compressed stream ends the records like a truncated file
+            if on_error is not None:
+                on_error(MalformedRecord(err.reason, offset))
+            return
+        if n == hdr_len and pkth.cap_len > limit:
+            if on_error is not None:
+                on_error(MalformedRecord(f'cap_len {pkth.cap_len} beyond any snapshot length', offset))
+            return
+        if n != hdr_len or len(payload) != pkth.cap_len:
+            if follow is not None:
+                fileobj.seek(offset)
+                waited = True
+                if follow.wait():
+                    continue
+                return
+            if n == hdr_len:
+                reason = f'truncated payload ({len(payload)} of {pkth.cap_len} bytes)'
+            elif n:
+                reason = 'truncated record header'
+            else:
+                return
+            if on_error is not None:
+                on_error(MalformedRecord(reason, offset))
+            return
+        if waited:
+            follow.reset()
+            waited = False
+
+        reason = _check_record(pkth.cap_len, pkth.pkt_len, snap_len, min_len)
+        if reason is None:
+            yield pkth, payload
+        elif on_error is not None:
+            on_error(MalformedRecord(reason, offset))
+        offset += hdr_len + pkth.cap_len
+
+def _check_record(cap_len, pkt_len, snap_len, min_len):
+    if (snap_len and cap_len > snap_len) or cap_len > pkt_len:
+        return f'cap_len {cap_len} exceeds snap_len {snap_len} or pkt_len {pkt_len}'
+    if cap_len < min_len:
+        return f'cap_len {cap_len} shorter than {min_len} bytes'
+    return None
+
+class StreamCapture:
+    '''
+    a classic pcap stream read from an asyncio.StreamReader, such as a pipe from
+    `tcpdump -w -`, a UNIX socket or a TCP connection. nothing is ever seeked,
+    so one event loop can multiplex many live feeds:
+
+        cap = await StreamCapture.open(reader)
+        async for pkth, payload in cap.records():
+            ...
+    '''
+
+    def __init__(self, stream, header):
+        self.stream = stream
+        self.header = header
+        self.byteorder = header.byteorder
+        self.nsec = header.nsec
+
+    @classmethod
+    async def open(cls, stream):
+        import asyncio
+
+        try:
+            raw = await stream.readexactly(PcapHeader.__hdr_len__)
+        except asyncio.IncompleteReadError:
+            raise ValueError('truncated pcap header') from None
+        if raw[:4] == PCAPNG_MAGIC:
+            raise ValueError('pcapng streams are not supported')
+        return cls(stream, header_class(raw).from_buffer_copy(raw))
+
+    async def records(self, on_error=None, min_len=0):
+        '''async counterpart of read_records, ending cleanly at the end of the stream'''
+        import asyncio
+
+        packet_header = self.header.packet_header
+        snap_len = self.header.snap_len
+        limit = max(snap_len, MAX_SNAPLEN)
+        offset = PcapHeader.__hdr_len__
+        while True:
+            try:
+                pkth = packet_header.from_buffer_copy(await self.stream.readexactly(packet_header.__hdr_len__))
+            except asyncio.IncompleteReadError as err:
+                if err.partial and on_error is not None:
+                    on_error(MalformedRecord('truncated record header', offset))
+                return
+            if pkth.cap_len > limit:
+                if on_error is not None:
+                    on_error(MalformedRecord(f'cap_len {pkth.cap_len} beyond any snapshot length', offset))
+                return
+            try:
+                payload = await self.stream.readexactly(pkth.cap_len)
+            except asyncio.IncompleteReadError as err:
+                if on_error is not None:
+                    on_error(MalformedRecord(f'truncated payload ({len(err.partial)} of {pkth.cap_len} bytes)', offset))
+                return
+
+            reason = _check_record(pkth.cap_len, pkth.pkt_len, snap_len, min_len)
+            if reason is None:
+                yield pkth, payload
+            elif on_error is not None:
+                on_error(MalformedRecord(reason, offset))
+            offset += len(pkth) + pkth.cap_len
+
+async def open_stdin(limit=1 << 20):
+    '''an asyncio.StreamReader over the standard input, for StreamCapture; stdin must be a pipe'''
+    import sys
+    import asyncio
+
+    reader = asyncio.StreamReader(limit=limit)
+    loop = asyncio.get_running_loop()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+    return reader
+
+class Follower:
+    '''
+    wait for a capture file to grow, through inotify where libc provides it and
+    otherwise by polling, sleeping from 1 ms up to max_interval while idle.
+    wait() returns False once idle_timeout seconds pass without a new record.
+    '''
+
+    IN_MODIFY = 0x2
+
+    def __init__(self, fileobj, idle_timeout=None, max_interval=0.1):
+        self.idle_timeout = idle_timeout
+        self.max_interval = max_interval
+        self.__fd = None
+        self.reset()
+
+        name = getattr(fileobj, 'name', None)
+        try:
+            libc = CDLL(None, use_errno=True)
+            inotify_init1 = libc.inotify_init1
+        except (OSError, TypeError, AttributeError):
+            return
+        if not isinstance(name, str):
+            return
+        fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return
+        if libc.inotify_add_watch(fd, os.fsencode(name), self.IN_MODIFY) < 0:
+            os.close(fd)
+            return
+        self.__fd = fd
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def reset(self):
+        self.__delay = 0.001
+        self.__idle_since = None
+
+    def wait(self):
+        now = time.monotonic()
+        if self.__idle_since is None:
+            self.__idle_since = now
+        timeout = None
+        if self.idle_timeout is not None:
+            timeout = self.__idle_since + self.idle_timeout - now
+            if timeout <= 0:
+                return False
+
+        if self.__fd is not None:
+            if select.select([self.__fd], [], [], timeout)[0]:
+                try:
+                    while os.read(self.__fd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            return True
+
+        time.sleep(self.__delay if timeout is None else min(self.__delay, timeout))
+        self.__delay = min(self.__delay * 2, self.max_interval)
+        return True
+
+# leading bytes of compressed captures -> compression
+COMPRESSIONS = {b'\x1f\x8b': 'gzip',
+                b'\xfd7zXZ\x00': 'xz',
+                b'\x28\xb5\x2f\xfd': 'zstd'}
+
+def compression(fileobj):
+    '''the compression of a stream from the bytes at its position, or None, leaving the position unchanged'''
+    try:
+        head = fileobj.peek(6)[:6]
+    except AttributeError:
+        pos = fileobj.tell()
+        head = fileobj.read(6)
+        fileobj.seek(pos)
+    return _compression_of(head)
+
+def _compression_of(head):
+    for magic, name in COMPRESSIONS.items():
+        if bytes(head[:len(magic)]) == magic:
+            return name
+    return None
+
+def _decompressor(name):
+    '''a new decompressor object with decompress(), eof and unused_data'''
+    if name == 'gzip':
+        import zlib
+
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if name == 'xz':
+        import lzma
+
+        return lzma.LZMADecompressor()
+    try:
+        from compression import zstd
+
+        return zstd.ZstdDecompressor()
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('reading zstd captures needs the zstandard package') from None
+    return zstandard.ZstdDecompressor().decompressobj()
+
+# compressed bytes given to a decompressor at once
+_FEED = 1 << 16
+
+def _decompress_into(read, name, q, stop):
+    '''
+    body of the background thread of Decompressed: put decompressed chunks on q,
+    then None at the end or the exception that stopped it, a MalformedRecord
+    for a truncated or corrupt stream. it holds no reference to the
+    Decompressed object, so dropping that object stops it.
+    '''
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        dec = _decompressor(name)
+        fed = False
+        while not stop.is_set():
+            data = read()
+            if not data:
+                if fed and not getattr(dec, 'eof', True):
+                    raise MalformedRecord(f'truncated {name} stream', None)
+                break
+            while data:
+                # fed a slice at a time, so that the data decompressed before
+                # a corrupt block is still handed over
+                piece, data = data[:_FEED], data[_FEED:]
+                try:
+                    out = dec.decompress(piece)
+                except Exception as err:
+                    # zlib.error, lzma.LZMAError and the zstd errors are no ValueError
+                    raise MalformedRecord(f'corrupt {name} stream ({err})', None) from err
+                fed = True
+                if out and not put(out):
+                    return
+                if getattr(dec, 'eof', False):
+                    # the next member or frame starts in the unused input
+                    data = dec.unused_data + data
+                    dec = _decompressor(name)
+                    fed = False
+        put(None)
+    except Exception as err:
+        put(err)
+
+class Decompressed(io.RawIOBase):
+    '''
+    the decompressed content of a gzip, xz or zstd stream. a background thread
+    reads and decompresses `chunk` bytes at a time, keeping up to `depth`
+    decompressed chunks ahead of the reader, so decompression overlaps with
+    parsing. concatenated members and frames are read one after another.
+    a file with a descriptor is read with pread, leaving its own position alone.
+    seeking forward skips data; seeking backward starts over from the beginning
+    of the compressed stream, which a pipe cannot do.
+    '''
+
+    def __init__(self, fileobj, name, chunk=1 << 20, depth=8):
+        super().__init__()
+        self.fileobj = fileobj
+        self.compression = name
+        self.chunk = chunk
+        self.depth = depth
+        try:
+            self.__fd = fileobj.fileno()
+            self.__origin = fileobj.tell()
+        except (OSError, AttributeError):
+            self.__fd = None
+            self.__origin = None
+        self.__thread = None
+        self.__start()
+
+    def __start(self):
+        self.__queue = queue.Queue(self.depth)
+        self.__stop = threading.Event()
+        self.__pending = memoryview(b'')
+        self.__pos = 0
+        self.__eof = False
+        if self.__fd is not None:
+            fd, chunk = self.__fd, self.chunk
+            offset = [self.__origin]
+
+            def read():
+                data = os.pread(fd, chunk, offset[0])
+                offset[0] += len(data)
+                return data
+        else:
+            read = partial(self.fileobj.read, self.chunk)
+        self.__thread = threading.Thread(target=_decompress_into, daemon=True,
+                                         args=(read, self.compression, self.__queue, self.__stop))
+        self.__thread.start()
+
+    @property
+    def name(self):
+        return self.fileobj.name
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.__fd is not None
+
+    def readinto(self, b):
+        if not self.__pending:
+            if self.__eof:
+                return 0
+            item = self.__queue.get()
+            if item is None:
+                self.__eof = True
+                return 0
+            if isinstance(item, Exception):
+                self.__eof = True
+                raise item
+            self.__pending = memoryview(item)
+        n = min(len(b), len(self.__pending))
+        b[:n] = self.__pending[:n]
+        self.__pending = self.__pending[n:]
+        self.__pos += n
+        return n
+
+    def tell(self):
+        return self.__pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.__pos
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('seek from the end of a compressed stream')
+        if offset < self.__pos:
+            if self.__fd is None:
+                raise io.UnsupportedOperation('seek backward in a compressed stream without a file descriptor')
+            self.__halt()
+            self.__start()
+        scratch = memoryview(bytearray(self.chunk))
+        while self.__pos < offset:
+            if not self.readinto(scratch[:offset - self.__pos]):
+                break
+        return self.__pos
+
+    def __halt(self):
+        if self.__thread is not None:
+            self.__stop.set()
+            self.__thread.join()
+            self.__thread = None
+
+    def close(self):
+        self.__halt()
+        super().close()
+
+def decompress(fileobj, chunk=1 << 20):
+    '''
+    fileobj itself when it is not compressed, otherwise a buffered stream of
+    its decompressed content, detected from the leading bytes. a zstd file
+    written in the seekable format is opened with pyzstd.SeekableZstdFile when
+    pyzstd is installed, for real random access; other compressed captures
+    are decompressed in a background thread by Decompressed.
+    '''
+    name = compression(fileobj)
+    if name is None:
+        return fileobj
+    if name == 'zstd':
+        try:
+            from pyzstd import SeekableZstdFile, SeekableFormatError
+        except ImportError:
+            pass
+        else:
+            pos = fileobj.tell()
+            try:
+                return SeekableZstdFile(fileobj, 'r')
+            except SeekableFormatError:
+                fileobj.seek(pos)
+    return io.BufferedReader(Decompressed(fileobj, name, chunk), chunk)
+
+class Capture:
+    '''
+    a pcap or pcapng stream whose format is detected once from its magic number,
+    read through decompress() when it is gzip, xz or zstd compressed.
+    header is the global header read in the file's byte order; for pcapng it is
+    synthesized from the first interface description block, and the records
+    carry microsecond timestamps converted from the interface resolution.
+    packets of pcapng interfaces with another link type than that of the
+    header are skipped, so that a decoder only sees payloads it can decode.
+    '''
+
+    def __init__(self, fileobj):
+        fileobj = decompress(fileobj)
+        self.fileobj = fileobj
+        self.__map = None
+        magic = fileobj.read(4)
+        if magic == PCAPNG_MAGIC:
+            self.pcapng = True
+            self.nsec = False
+            self.__start = 0
+            self.__interfaces = []
+            blocks = self.__read_blocks(magic)
+            for block_type, body in blocks:
+                self.__on_block(block_type, body)
+                if self.__interfaces:
+                    break
+            else:
+                raise ValueError('no interface description block in pcapng file')
+            link_type, snap_len, _ = self.__interfaces[0]
+            self.header = PcapHeader(MAGIC_USEC, self.__version[0], self.__version[1],
+                                     0, 0, snap_len, link_type)
+        else:
+            rest = fileobj.read(PcapHeader.__hdr_len__ - len(magic))
+            if len(magic) + len(rest) != PcapHeader.__hdr_len__:
+                raise ValueError('truncated pcap header')
+            self.pcapng = False
+            self.header = header_class(magic).from_buffer_copy(magic + rest)
+            self.byteorder = self.header.byteorder
+            self.nsec = self.header.nsec
+            self.__start = PcapHeader.__hdr_len__
+
+    def rewind(self):
+        self.fileobj.seek(self.__start)
+
+    def records(self, on_error=None, min_len=0, follow=None):
+        '''
+        yield (PacketHeader, bytes) pairs from the current position,
+        with the same error handling and follow mode as read_records
+        '''
+        if not self.pcapng:
+            return read_records(self.fileobj, self.header.snap_len, on_error, min_len=min_len,
+                                packet_header=self.header.packet_header, follow=follow)
+        if follow is not None:
+            raise ValueError('follow mode needs a classic pcap file')
+        return self.__pcapng_records(on_error, min_len)
+
+    def mapping(self):
+        '''
+        the classic pcap file mapped with map_file, or None when it is pcapng,
+        compressed, in memory or not a regular file. the mapping is kept and
+        made again once the file has grown.
+        '''
+        if self.pcapng:
+            return None
+        try:
+            fd = self.fileobj.fileno()
+        except (AttributeError, OSError):
+            return None
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode) or _compression_of(os.pread(fd, 6, 0)) is not None:
+            return None
+        if self.__map is None or len(self.__map) != st.st_size:
+            self.__map = map_file(self.fileobj)
+        return self.__map
+
+    def walk(self, buf, on_error=None, min_len=0):
+        '''
+        frame the records of buf, the mapping() of this capture, from the current
+        position with the same checks as records(), but with nothing read or
+        copied: yields (timestamp_sec, timestamp_frac, cap_len, offset) tuples,
+        offset being that of the payload in buf, for decoders to unpack in place.
+        the file is positioned after the last record taken once the iteration
+        ends or is dropped, so reads and walks can take turns.
+        '''
+        f = self.fileobj
+        unpack = struct.Struct(self.byteorder + 'IIII').unpack_from
+        snap_len = self.header.snap_len
+        limit = max(snap_len, MAX_SNAPLEN)
+        end = len(buf)
+        offset = f.tell()
+        reason = None
+        try:
+            while offset + 16 <= end:
+                sec, frac, cap_len, pkt_len = unpack(buf, offset)
+                start = offset + 16
+                if cap_len > limit:
+                    reason = f'cap_len {cap_len} beyond any snapshot length'
+                    break
+                if start + cap_len > end:
+                    reason = f'truncated payload ({end - start} of {cap_len} bytes)'
+                    break
+                record, offset = offset, start + cap_len
+                # _check_record inlined, it is only called for the reason
+                if cap_len > pkt_len or cap_len < min_len or (snap_len and cap_len > snap_len):
+                    if on_error is not None:
+                        on_error(MalformedRecord(_check_record(cap_len, pkt_len, snap_len, min_len), record))
+                    continue
+                yield sec, frac, cap_len, start
+            else:
+                if offset < end:
+                    reason = 'truncated record header'
+            if reason is not None and on_error is not None:
+                on_error(MalformedRecord(reason, offset))
+        finally:
+            if not f.closed:
+                f.seek(offset)
+
+    def __read_blocks(self, magic=b''):
+        f = self.fileobj
+        while True:
+            head = magic + f.read(8 - len(magic))
+            magic = b''
+            if not head:
+                return
+            if len(head) == 8 and head[:4] == PCAPNG_MAGIC:
+                bom = f.read(4)
+                order = '<' if bom == struct.pack('<I', PCAPNG_BYTE_ORDER) else '>'
+                if bom != struct.pack(order + 'I', PCAPNG_BYTE_ORDER):
+                    raise MalformedRecord('bad byte-order magic in section header', None)
+                self.byteorder = order
+                block_type, block_len = struct.unpack(order + 'II', head)
+                body = bom + f.read(max(block_len - 12, 0))
+            elif len(head) == 8:
+                block_type, block_len = struct.unpack(self.byteorder + 'II', head)
+                body = f.read(max(block_len - 8, 0))
+            else:
+                block_len = 0
+            if block_len < 12 or block_len % 4 or len(body) != block_len - 8:
+                raise MalformedRecord('truncated or misaligned pcapng block', None)
+            yield block_type, body[:-4]
+
+    # shortest bodies of the blocks whose fixed fields are unpacked, without the trailing length
+    __min_body__ = {PCAPNG_SHB: 8, 1: 8, 3: 4, 6: 20}
+
+    def __on_block(self, block_type, body):
+        order = self.byteorder
+        if block_type == PCAPNG_SHB:
+            # section header: a new section starts with no interfaces
+            self.__check_body(block_type, body)
+            self.__version = struct.unpack_from(order + 'HH', body, 4)
+            self.__interfaces = []
+        elif block_type == 1:
+            self.__check_body(block_type, body)
+            link_type, snap_len = struct.unpack_from(order + 'HxxI', body)
+            units = 10 ** 6
+            offset = 8
+            while offset + 4 <= len(body):
+                code, length = struct.unpack_from(order + 'HH', body, offset)
+                if code == 0:
+                    break
+                if code == 9 and length == 1:
+                    resol = body[offset + 4]
+                    units = 1 << (resol & 0x7f) if resol & 0x80 else 10 ** resol
+                offset += 4 + (length + 3) // 4 * 4
+            self.__interfaces.append((link_type, snap_len, units))
+
+    def __check_body(self, block_type, body):
+        if len(body) < self.__min_body__[block_type]:
+            raise MalformedRecord(f'pcapng block of type {block_type:#x} with a {len(body)} byte body, '
+                                  f'shorter than {self.__min_body__[block_type]}', None)
+
+    def __pcapng_records(self, on_error, min_len):
+        order = self.byteorder
+        try:
+            for block_type, body in self.__read_blocks():
+                if block_type not in (3, 6):
+                    self.__on_block(block_type, body)
+                    order = self.byteorder
+                    continue
+
+                if len(body) < self.__min_body__[block_type]:
+                    # the block length is sound, so the next block is still found
+                    if on_error is not None:
+                        on_error(MalformedRecord(f'packet block with a {len(body)} byte body, '
+                                                 f'shorter than {self.__min_body__[block_type]}', None))
+                    continue
+                if block_type == 6:
+                    iface, ts_high, ts_low, cap_len, pkt_len = struct.unpack_from(order + '5I', body)
+                    data = 20
+                else:
+                    iface, ts_high, ts_low = 0, 0, 0
+                    pkt_len, = struct.unpack_from(order + 'I', body)
+                    data = 4
+                    cap_len = min(pkt_len, len(body) - data)
+
+                if iface >= len(self.__interfaces):
+                    reason = f'unknown interface {iface}'
+                elif self.__interfaces[iface][0] != self.header.link_type:
+                    # a packet of another link layer, not for the decoder of this capture
+                    continue
+                elif data + cap_len > len(body):
+                    reason = f'cap_len {cap_len} beyond the end of its block'
+                elif cap_len < min_len:
+                    reason = f'cap_len {cap_len} shorter than {min_len} bytes'
+                else:
+                    units = self.__interfaces[iface][2]
+                    sec, frac = divmod(ts_high << 32 | ts_low, units)
+                    pkth = PacketHeader(sec, frac * 10 ** 6 // units, cap_len, pkt_len)
+                    yield pkth, body[data:data + cap_len]
+                    continue
+                if on_error is not None:
+                    on_error(MalformedRecord(reason, None))
+        except MalformedRecord as err:
+            if on_error is not None:
+                on_error(err)
+
+def open_reader(fileobj, **kwargs):
+    '''
+    a Reader over the capture from the decoder registered for its link type,
+    e.g. a linux_evdev.Reader for LINKTYPE_LINUX_EVDEV. kwargs go to the Reader.
+    the global header is read only once, so fileobj may be a pipe.
+    raises ValueError when no decoder handles the link type.
+    '''
+    cap = Capture(fileobj)
+    module = decoder(cap.header.link_type)
+    if module is None:
+        raise ValueError(f'no decoder for link type {cap.header.link_type}')
+    return module.Reader(fileobj, capture=cap, **kwargs)
+
+def map_file(fileobj):
+    '''
+    map the whole capture into memory without reading it.
+    the mapping is copy-on-write so that ctypes from_buffer can point into it,
+    and it is released once the last header or payload view into it is dropped.
+    in-memory streams without a file descriptor, and compressed captures once
+    decompressed, are copied into a bytearray instead.
+    '''
+    try:
+        fd = fileobj.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        fileobj.seek(0)
+        data = fileobj.read()
+        if _compression_of(data[:6]) is not None:
+            data = decompress(io.BytesIO(data)).read()
+        return bytearray(data)
+    if _compression_of(os.pread(fd, 6, 0)) is not None:
+        fileobj.seek(0)
+        return bytearray(decompress(fileobj).read())
+    return mmap.mmap(fd, 0, access=mmap.ACCESS_COPY)
+
+def iter_records(buf, offset=PcapHeader.__hdr_len__, end=None, packet_header=PacketHeader):
+    '''
+    walk the records of a mapped capture without copying.
+    yields (PacketHeader, memoryview) pairs pointing into buf, following cap_len
+    to the next record. a truncated trailing record ends the iteration.
+    '''
+    view = memoryview(buf)
+    if end is None:
+        end = len(view)
+    hdr_len = packet_header.__hdr_len__
+    while offset + hdr_len <= end:
+        pkth = packet_header.from_buffer(buf, offset)
+        offset += hdr_len
+        if offset + pkth.cap_len > end:
+            break
+        yield pkth, view[offset:offset + pkth.cap_len]
+        offset += pkth.cap_len
+
+class RecordIndex:
+    '''
+    offsets and microsecond timestamps of the records of a classic pcap file,
+    held as uint64 arrays for random access and time lookups.
+    update() only scans what was appended since the previous call, leaving a
+    partially written trailing record for the next one. with a sidecar path the
+    index is also cached on disk, keyed by the size and mtime of the capture and
+    by the headers of its first and last indexed records, which must still be
+    in place for the cached offsets of a grown capture to be reused. the entries
+    of a grown capture are appended to the sidecar, not rewritten with it.
+    '''
+
+    SUFFIX = '.idx'
+    __magic__ = b'PID3'
+    # magic, capture size, capture mtime, end, first and last record header,
+    # followed by the (offset, time) pairs of the records
+    __key__ = struct.Struct('<4sQQQ16s16s')
+
+    def __init__(self, header, sidecar=None):
+        self.packet_header = header.packet_header
+        self.nsec = header.nsec
+        self.sidecar = sidecar
+        self.__clear()
+
+    def __clear(self):
+        self.offsets = array('Q')
+        self.times = array('Q')
+        self.end = PcapHeader.__hdr_len__
+        # entries already in the sidecar, None when it has to be rewritten
+        self.__saved = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def update(self, fileobj):
+        buf = map_file(fileobj)
+        # only a mapped file has a size and mtime to key the sidecar with
+        st = os.fstat(fileobj.fileno()) if isinstance(buf, mmap.mmap) else None
+        size = len(buf)
+        if self.sidecar and st is not None and not self.offsets:
+            self.__load(st, buf)
+        if size < self.end:
+            self.__clear()
+
+        end = self.end
+        div = 1000 if self.nsec else 1
+        for pkth, _ in iter_records(buf, end, packet_header=self.packet_header):
+            self.offsets.append(end)
+            self.times.append(pkth.timestamp_sec * 1000000 + pkth.timestamp_usec // div)
+            end += len(pkth) + pkth.cap_len
+
+        grown = end != self.end
+        self.end = end
+        if self.sidecar and st is not None and (grown or self.__saved != len(self.offsets)):
+            self.__save(st, buf)
+        return self
+
+    def bisect(self, ts):
+        '''index of the first record at or after ts, in seconds; records are assumed to be in time order'''
+        return bisect_left(self.times, int(ts * 1000000))
+
+    def __headers(self, buf):
+        '''the raw headers of the first and last indexed records, zeros without records'''
+        if not self.offsets:
+            return bytes(16), bytes(16)
+        first, last = self.offsets[0], self.offsets[-1]
+        return bytes(buf[first:first + 16]), bytes(buf[last:last + 16])
+
+    def __load(self, st, buf):
+        try:
+            f = open(self.sidecar, 'rb')
+        except OSError:
+            return
+        with f:
+            key = f.read(self.__key__.size)
+            if len(key) != self.__key__.size:
+                return
+            magic, size, mtime, end, first, last = self.__key__.unpack(key)
+            if magic != self.__magic__ or size > st.st_size or (size == st.st_size and mtime != st.st_mtime_ns):
+                return
+            pairs = array('Q')
+            try:
+                pairs.fromfile(f, (os.fstat(f.fileno()).st_size - len(key)) // 16 * 2)
+            except EOFError:
+                return
+            self.offsets, self.times = pairs[0::2], pairs[1::2]
+            # pairs appended after the key of the last save was written are dropped
+            del self.offsets[bisect_left(self.offsets, end):]
+            del self.times[len(self.offsets):]
+            # a capture that only grew keeps its indexed prefix, one rewritten
+            # since is caught by the records no longer starting where they did
+            if self.__headers(buf) != (first, last):
+                self.__clear()
+                return
+            self.end = end
+            self.__saved = len(self.offsets)
+
+    def __save(self, st, buf):
+        saved = self.__saved
+        if saved is not None and not os.path.exists(self.sidecar):
+            saved = None
+        pairs = array('Q', bytes(16 * (len(self.offsets) - (saved or 0))))
+        pairs[0::2] = self.offsets[saved:]
+        pairs[1::2] = self.times[saved:]
+        key = self.__key__.pack(self.__magic__, st.st_size, st.st_mtime_ns, self.end, *self.__headers(buf))
+        with open(self.sidecar, 'wb' if saved is None else 'r+b') as f:
+            # the new pairs go first, so a save cut short leaves the old key valid
+            f.seek(len(key) + 16 * (saved or 0))
+            f.truncate()
+            pairs.tofile(f)
+            f.seek(0)
+            f.write(key)
+        self.__saved = len(self.offsets)
+
+class Writer:
+    '''
+    write a classic pcap file: the global header, then records given either as
+    fields (write) or as raw record bytes of a capture in the same format
+    (write_raw), such as ranges of a mapped file. small pieces are packed into
+    one buffer and large ones queued as they are, and everything is handed to
+    the kernel in one writev call per `buffer` bytes, so copied ranges never go
+    through an intermediate copy. header is the PcapHeader of the source when
+    its records are copied raw; otherwise one is built from the arguments.
+
+        with Writer(open('out.pcap', 'wb'), LINKTYPE_LINUX_EVDEV) as w:
+            w.write(sec, usec, payload)
+    '''
+
+    # pieces shorter than this are copied into the pending buffer rather than queued
+    __copy_below__ = 4096
+
+    def __init__(self, fileobj, link_type=None, byteorder='<', nsec=False, snap_len=MAX_SNAPLEN,
+                 header=None, buffer=1 << 20):
+        if header is None:
+            if link_type is None:
+                raise ValueError('a link type or a source header is needed')
+            header = PcapHeader if byteorder == '<' else PcapHeaderBE
+            header = header(MAGIC_NSEC if nsec else MAGIC_USEC, 2, 4, 0, 0, snap_len, link_type)
+        self.header = header
+        self.fileobj = fileobj
+        self.buffer = buffer
+        self.records = 0
+        self.__packet = struct.Struct(header.byteorder + 'IIII')
+        self.__pieces = []
+        self.__small = bytearray(bytes(header))
+        self.__pending = len(self.__small)
+        try:
+            self.__fd = fileobj.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            self.__fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def write(self, sec, frac, data, pkt_len=None):
+        '''add a record; frac is in micro or nanoseconds like the file'''
+        small = self.__small
+        small += self.__packet.pack(sec, frac, len(data), len(data) if pkt_len is None else pkt_len)
+        small += data
+        self.records += 1
+        self.__pending += 16 + len(data)
+        if self.__pending >= self.buffer:
+            self.flush()
+
+    def write_raw(self, data, records=1):
+        '''add the bytes of `records` whole records, headers included, in the format of the file'''
+        if len(data) < self.__copy_below__:
+            self.__small += data
+        else:
+            if self.__small:
+                self.__pieces.append(self.__small)
+                self.__small = bytearray()
+            self.__pieces.append(data)
+        self.records += records
+        self.__pending += len(data)
+        if self.__pending >= self.buffer:
+            self.flush()
+
+    def flush(self):
+        pieces = self.__pieces
+        if self.__small:
+            pieces.append(self.__small)
+        self.__pieces = []
+        self.__small = bytearray()
+        self.__pending = 0
+        if self.__fd is None:
+            for piece in pieces:
+                self.fileobj.write(piece)
+            return
+        # data buffered by the file object goes first
+        self.fileobj.flush()
+        _writev(self.__fd, pieces)
+
+def _writev(fd, pieces):
+    '''write all pieces, resuming after partial writes and in batches of at most IOV_MAX'''
+    try:
+        iov_max = os.sysconf('SC_IOV_MAX')
+    except (AttributeError, ValueError, OSError):
+        iov_max = 1024
+    views = [memoryview(piece).cast('B') for piece in pieces if len(piece)]
+    i = 0
+    while i < len(views):
+        written = os.writev(fd, views[i:i + iov_max])
+        while written:
+            if written >= len(views[i]):
+                written -= len(views[i])
+                i += 1
+            else:
+                views[i] = views[i][written:]
+                written = 0
 
 def show_pcap_header(pcap_header):
     print(f'magic number : {hex(pcap_header.magic_num)}')
@@ -53,18 +1038,15 @@ def debug():
     # file_name = 'test.pcap'
 
     # buffer = io.BytesIO(string.ascii_lowercase.encode('utf-8')[:24])
-    buffer = open(file_name, 'rb')
-    ph = PcapHeader()
-    pkth = PacketHeader()
-    buffer.readinto(ph)
+    buffer = map_file(open(file_name, 'rb'))
+    ph = header_class(buffer).from_buffer(buffer)
     show_pcap_header(ph)
-    for _ in range(10):
-        buffer.readinto(pkth)
+    for _, (pkth, payload) in zip(range(10), iter_records(buffer, packet_header=ph.packet_header)):
         print('----------------------------')
         print('----------------------------')
         show_packet_header(pkth)
         print('----------------------------')
-        print(buffer.read(24))
+        print(bytes(payload))
 
 if __name__ == '__main__':
     # Check debug flag